@@ -0,0 +1,214 @@
+"""Benchmarks every combination of reward model, estimator and selector in the framework over several numbers of
+actions and steps. Reports steps per second, peak traced memory and the allocated blocks a step retains (not every
+allocation it makes), writes the results to JSON and compares them with the committed baseline, failing when
+throughput regresses or a combination is missing on either side. Throughput is compared relative to a calibration loop
+timed next to every combination, so that a slower or loaded machine does not count as a regression. The compact
+estimators only run with the compact greedy selector, which needs them.
+
+Usage: python -m benchmarks.bench_framework [--output results.json] [--update-baseline]"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from framework.action_selectors import CompactGreedyActionSelector, GreedyActionSelector, SoftmaxActionSelector, \
+    UCBActionSelector
+from framework.action_value_estimators import AverageRewardsEstimator, CompactConstantStepSizeActionValueEstimator, \
+    CompactIncrementalRewardActionValueEstimator, ConstantStepSizeActionValueEstimator, GradientBanditEstimator, \
+    IncrementalRewardActionValueEstimator
+from framework.rewards import NormalDistributionReward, RandomWalkActionReward
+from framework.runner import Runner
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+REWARDS = {
+    'normal': lambda num_actions: NormalDistributionReward(num_actions),
+    'random_walk': lambda num_actions: RandomWalkActionReward(0.0, num_actions)
+}
+
+ESTIMATORS = {
+    'avg': lambda num_actions: AverageRewardsEstimator(num_actions),
+    'incremental': lambda num_actions: IncrementalRewardActionValueEstimator(num_actions),
+    'constant_step_size': lambda num_actions: ConstantStepSizeActionValueEstimator(num_actions, 0.1),
+    'gradient': lambda num_actions: GradientBanditEstimator(num_actions, 0.1),
+    'compact_incremental': lambda num_actions: CompactIncrementalRewardActionValueEstimator(num_actions),
+    'compact_constant_step_size': lambda num_actions: CompactConstantStepSizeActionValueEstimator(num_actions, 0.1)
+}
+
+SELECTORS = {
+    'greedy': lambda estimator: GreedyActionSelector(estimator, 0.1),
+    'ucb': lambda estimator: UCBActionSelector(estimator, 2),
+    'softmax': lambda estimator: SoftmaxActionSelector(estimator),
+    'compact_greedy': lambda estimator: CompactGreedyActionSelector(estimator, 0.1)
+}
+
+NUM_ACTIONS = [10, 1000]
+STEPS = [1000, 10000]
+
+
+def is_combination(estimator_name, selector_name):
+    return estimator_name.startswith('compact_') == selector_name.startswith('compact_')
+
+
+def build_runner(reward_name, estimator_name, selector_name, num_actions):
+    estimator = ESTIMATORS[estimator_name](num_actions)
+    return Runner(REWARDS[reward_name](num_actions), estimator, SELECTORS[selector_name](estimator))
+
+
+def calibrate(repeat=5, iterations=20000):
+    """
+    Speed of the machine right now, from a fixed loop of the scalar Python and numpy work that a step does.
+    :return: iterations per second, the best of :repeat: runs
+    """
+    values = np.zeros(16)
+    best_time = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total = 0.0
+        for iteration in range(iterations):
+            index = iteration & 15
+            values[index] += (iteration - values[index]) * 0.1
+            total += values[index]
+        best_time = min(best_time, time.perf_counter() - start)
+    return iterations / best_time
+
+
+def benchmark(reward_name, estimator_name, selector_name, num_actions, steps, repeat=3):
+    """
+    :return: the measurements of one combination. Throughput is the best of :repeat: runs; memory is measured in a
+    separate run, since tracing slows the run down. The retained blocks are the net change of the allocated blocks
+    over a run, i.e. what the steps leave allocated, not every allocation they make.
+    """
+    np.random.seed(0)
+    runner = build_runner(reward_name, estimator_name, selector_name, num_actions)
+    runner.run_steps(min(steps, 100))
+
+    calibration = calibrate()
+    best_time = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runner.run_steps(steps)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    blocks_before = sys.getallocatedblocks()
+    result = runner.run_steps(steps)
+    retained_blocks = sys.getallocatedblocks() - blocks_before
+    del result
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    runner.run_steps(steps)
+    peak_memory = tracemalloc.get_traced_memory()[1] - traced_before
+    tracemalloc.stop()
+
+    return {
+        'reward': reward_name,
+        'estimator': estimator_name,
+        'selector': selector_name,
+        'num_actions': num_actions,
+        'steps': steps,
+        'steps_per_sec': steps / best_time,
+        'calibration': calibration,
+        'peak_memory_bytes': peak_memory,
+        'retained_blocks_per_step': retained_blocks / steps
+    }
+
+
+def run_benchmarks(num_actions_list=NUM_ACTIONS, steps_list=STEPS):
+    results = []
+    for reward_name, estimator_name, selector_name, num_actions, steps in itertools.product(
+            REWARDS, ESTIMATORS, SELECTORS, num_actions_list, steps_list):
+        if not is_combination(estimator_name, selector_name):
+            continue
+        result = benchmark(reward_name, estimator_name, selector_name, num_actions, steps)
+        print("{reward:>12} {estimator:>26} {selector:>14} actions={num_actions:<6} steps={steps:<6} "
+              "{steps_per_sec:>12,.0f} steps/s {peak_memory_bytes:>10,} B peak "
+              "{retained_blocks_per_step:>6.3f} retained blocks/step"
+              .format(**result))
+        results.append(result)
+
+    return {
+        'machine': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform()},
+        'results': results
+    }
+
+
+def _key(result):
+    return result['reward'], result['estimator'], result['selector'], result['num_actions'], result['steps']
+
+
+def compare(report, baseline, tolerance=0.5, memory_tolerance=1.0):
+    """
+    Throughput may drop by :tolerance: and peak memory may grow by :memory_tolerance: (as fractions of the baseline)
+    before it counts as a regression. The baseline throughput is first scaled by the ratio of the calibrations, since
+    timings differ between machines and runs.
+    :return: descriptions of the regressions and of the combinations only one of the report and baseline has
+    """
+    baseline_results = {_key(result): result for result in baseline['results']}
+    result_keys = {_key(result) for result in report['results']}
+    regressions = ["{}: not in the baseline, update it".format(key)
+                   for key in sorted(result_keys - baseline_results.keys())]
+    regressions.extend("{}: in the baseline, but not measured".format(key)
+                       for key in sorted(baseline_results.keys() - result_keys))
+    for result in report['results']:
+        expected = baseline_results.get(_key(result))
+        if expected is None:
+            continue
+        expected_steps_per_sec = expected['steps_per_sec'] * result['calibration'] / expected['calibration']
+        if result['steps_per_sec'] < expected_steps_per_sec * (1 - tolerance):
+            regressions.append("{}: {:,.0f} steps/s, baseline {:,.0f} at the speed of this run".format(
+                _key(result), result['steps_per_sec'], expected_steps_per_sec))
+        # Small runs are dominated by constant overhead, so allow a fixed 64 KiB on top of the tolerance
+        if result['peak_memory_bytes'] > expected['peak_memory_bytes'] * (1 + memory_tolerance) + 65536:
+            regressions.append("{}: {:,} B peak memory, baseline {:,} B".format(
+                _key(result), result['peak_memory_bytes'], expected['peak_memory_bytes']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline JSON file to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed throughput drop, as a fraction")
+    parser.add_argument('--update-baseline', action='store_true', help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Baseline updated: {}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}".format(args.baseline))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print("{} regressions against {}:".format(len(regressions), args.baseline))
+        for regression in regressions:
+            print("  " + regression)
+        return 1
+
+    print("No regressions against {}".format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Benchmarks the per step latency of epsilon greedy bandits with very many actions, for the compact estimators and
+selector against the default ones. The compact step costs O(log num_actions), so its latency should stay roughly flat
+from 100 to 1,000,000 actions, while the default estimators rescan all actions, in O(num_actions), whenever the last
+greedy action loses its lead. Also reports how often the default estimators rescan per step, and the bytes of
+estimator state per action.
+
+Usage: python -m benchmarks.bench_large_actions [--num-actions 100 10000 1000000] [--steps 20000] [--output r.json]"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from framework.action_selectors import CompactGreedyActionSelector, GreedyActionSelector
+from framework.action_value_estimators import CompactConstantStepSizeActionValueEstimator, \
+    CompactIncrementalRewardActionValueEstimator, ConstantStepSizeActionValueEstimator, \
+    IncrementalRewardActionValueEstimator
+from framework.rewards import NormalDistributionReward, RandomWalkActionReward
+from framework.runner import Runner
+
+VARIANTS = {
+    'default': (lambda num_actions: ConstantStepSizeActionValueEstimator(num_actions, 0.1),
+                lambda num_actions: IncrementalRewardActionValueEstimator(num_actions),
+                GreedyActionSelector),
+    'compact': (lambda num_actions: CompactConstantStepSizeActionValueEstimator(num_actions, 0.1),
+                lambda num_actions: CompactIncrementalRewardActionValueEstimator(num_actions),
+                CompactGreedyActionSelector)
+}
+
+REWARDS = {
+    'random_walk': lambda num_actions: RandomWalkActionReward(0.0, num_actions, dtype=np.float32),
+    'normal': lambda num_actions: NormalDistributionReward(num_actions, dtype=np.float32)
+}
+
+NUM_ACTIONS = [100, 10_000, 1_000_000]
+
+
+def estimator_bytes(estimator):
+    """
+    :return: bytes held by the arrays, buffers and lists of the estimator
+    """
+    total = 0
+    for value in vars(estimator).values():
+        if isinstance(value, np.ndarray) and value.base is None:
+            total += value.nbytes
+        elif isinstance(value, list):
+            total += sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+        elif hasattr(value, 'buffer_info'):
+            total += value.buffer_info()[1] * value.itemsize
+        elif hasattr(value, '__dict__'):
+            total += estimator_bytes(value)
+    return total
+
+
+def count_rescans(estimator):
+    """
+    Counts the O(num_actions) rescans of the greedy actions of a default estimator; the compact ones never rescan.
+    :return: list whose length is the number of rescans so far
+    """
+    rescans = []
+    if hasattr(estimator, '_find_greedy_actions'):
+        find_greedy_actions = estimator._find_greedy_actions
+
+        def counting_find_greedy_actions():
+            rescans.append(None)
+            find_greedy_actions()
+
+        estimator._find_greedy_actions = counting_find_greedy_actions
+    return rescans
+
+
+def benchmark(variant, reward_name, num_actions, steps, repeat=3):
+    """
+    The constant step size estimator runs on the random walk, the incremental one on the stationary normal rewards.
+    :return: the measurements of one combination; latency is the best of :repeat: runs
+    """
+    np.random.seed(0)
+    constant_estimator, incremental_estimator, selector_class = VARIANTS[variant]
+    estimator = (constant_estimator if reward_name == 'random_walk' else incremental_estimator)(num_actions)
+    runner = Runner(REWARDS[reward_name](num_actions), estimator, selector_class(estimator, 0.1))
+    rescans = count_rescans(estimator)
+
+    best_time = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        runner.run_steps(steps)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    return {
+        'variant': variant,
+        'reward': reward_name,
+        'num_actions': num_actions,
+        'steps': steps,
+        'us_per_step': best_time / steps * 1e6,
+        'rescans_per_step': len(rescans) / (repeat * steps),
+        'estimator_bytes_per_action': estimator_bytes(estimator) / num_actions
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-actions', type=int, nargs='+', default=NUM_ACTIONS)
+    parser.add_argument('--steps', type=int, default=20000)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for reward_name in REWARDS:
+        for variant in VARIANTS:
+            for num_actions in args.num_actions:
+                result = benchmark(variant, reward_name, num_actions, args.steps)
+                print("{reward:>12} {variant:>8} actions={num_actions:<8} {us_per_step:>8.2f} us/step "
+                      "{rescans_per_step:>7.4f} rescans/step {estimator_bytes_per_action:>6.1f} B/action"
+                      .format(**result))
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Load generator for **BanditService**. Starts the service in a separate process on a local port, then runs
+concurrent clients that each select an action, draw its reward from a normal distribution with a mean per action and
+report it, as fast as the service answers. Reports the requests per second, the p50 and p99 latency of selections and
+reward reports, the batches the service coalesced them into and how often the optimal action was selected.
+
+Usage: python -m benchmarks.bench_service [--clients 64] [--duration 5] [--max-batch 256] [--max-delay 0.005]"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from framework.action_selectors import GreedyActionSelector
+from framework.action_value_estimators import ConstantStepSizeActionValueEstimator
+from framework.service import BanditService
+
+
+def serve(connection, num_actions, epsilon, alpha, max_batch, max_delay):
+    """
+    Runs the service until the parent sends anything over :connection:, then sends back its stats.
+    """
+    async def main():
+        estimator = ConstantStepSizeActionValueEstimator(num_actions, alpha)
+        service = BanditService(estimator, GreedyActionSelector(estimator, epsilon), max_batch, max_delay)
+        server = await service.start_server()
+        connection.send(server.sockets[0].getsockname()[1])
+        await asyncio.get_running_loop().run_in_executor(None, connection.recv)
+        server.close()
+        service.flush()
+        connection.send(service.get_stats())
+
+    asyncio.run(main())
+
+
+async def run_client(port, q_a_means, deadline, latencies, optimal_actions, seed):
+    random = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    optimal_action = int(np.argmax(q_a_means))
+    select_latencies, report_latencies = latencies
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        writer.write(b'SELECT\n')
+        action = int(await reader.readline())
+        selected = time.perf_counter()
+        writer.write(b'REWARD %d %r\n' % (action, float(q_a_means[action] + random.standard_normal())))
+        response = await reader.readline()
+        if response != b'OK\n':
+            raise RuntimeError("Reward report failed: {!r}".format(response))
+        select_latencies.append(selected - start)
+        report_latencies.append(time.perf_counter() - selected)
+        optimal_actions.append(action == optimal_action)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def generate_load(port, q_a_means, clients, duration):
+    latencies = ([], [])
+    optimal_actions = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(port, q_a_means, start + duration, latencies, optimal_actions, seed)
+                           for seed in range(clients)])
+    return time.perf_counter() - start, latencies, optimal_actions
+
+
+def benchmark(clients=64, duration=5.0, num_actions=10, epsilon=0.1, alpha=0.1, max_batch=256, max_delay=0.005):
+    """
+    :return: the measurements of one run
+    """
+    q_a_means = np.random.default_rng(0).standard_normal(num_actions)
+    connection, child_connection = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child_connection, num_actions, epsilon, alpha, max_batch,
+                                                         max_delay))
+    server.start()
+    try:
+        port = connection.recv()
+        elapsed, (select_latencies, report_latencies), optimal_actions = \
+            asyncio.run(generate_load(port, q_a_means, clients, duration))
+        connection.send('stop')
+        stats = connection.recv()
+    finally:
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+
+    requests = len(select_latencies) + len(report_latencies)
+    last_quarter = optimal_actions[len(optimal_actions) * 3 // 4:]
+    return {
+        'clients': clients,
+        'max_batch': max_batch,
+        'max_delay': max_delay,
+        'requests_per_sec': requests / elapsed,
+        'select_p50_ms': float(np.percentile(select_latencies, 50) * 1e3),
+        'select_p99_ms': float(np.percentile(select_latencies, 99) * 1e3),
+        'report_p50_ms': float(np.percentile(report_latencies, 50) * 1e3),
+        'report_p99_ms': float(np.percentile(report_latencies, 99) * 1e3),
+        'rewards_per_batch': stats['rewards'] / max(stats['reward_batches'], 1),
+        'selections_per_batch': stats['selections'] / max(stats['selection_batches'], 1),
+        'optimal_action_pct_last_quarter': float(np.mean(last_quarter)) if last_quarter else 0.0
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds of load")
+    parser.add_argument('--num-actions', type=int, default=10)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-delay', type=float, default=0.005, help="seconds a reward may wait for its batch")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    result = benchmark(args.clients, args.duration, args.num_actions, max_batch=args.max_batch,
+                       max_delay=args.max_delay)
+    print("clients={clients} max_batch={max_batch} max_delay={max_delay}: {requests_per_sec:,.0f} requests/s, "
+          "select p50 {select_p50_ms:.2f} ms p99 {select_p99_ms:.2f} ms, report p50 {report_p50_ms:.2f} ms "
+          "p99 {report_p99_ms:.2f} ms, {rewards_per_batch:.1f} rewards and {selections_per_batch:.1f} selections "
+          "per batch, optimal action {optimal_action_pct_last_quarter:.1%} in the last quarter".format(**result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 from framework.action_selectors import GreedyActionSelector
 from framework.action_value_estimators import *
 from framework.rewards import RandomWalkActionReward
-from framework.runner import Runner
+from framework.sweep import ParameterSweep, SweepCell, expand
 
 
 def epsilon_parameter_generator(init=1 / 128, ratio=2):
@@ -17,14 +17,15 @@ def epsilon_parameter_generator(init=1 / 128, ratio=2):
         element *= ratio
 
 
-def run():
+def run(cache_dir='.sweep_cache/exercise_2_11'):
     num_actions = 10
-    init_q_a = np.random.rand()
+    # All q_a start out equal; a fixed value keeps the cells cacheable between runs
+    init_q_a = 0.5
 
     estimators = {
-        'avg': AverageRewardsEstimator(num_actions),
-        'incremental': IncrementalRewardActionValueEstimator(num_actions),
-        'constant_step_size': ConstantStepSizeActionValueEstimator(num_actions, 0.1)
+        'avg': (AverageRewardsEstimator, {'num_actions': num_actions}),
+        'incremental': (IncrementalRewardActionValueEstimator, {'num_actions': num_actions}),
+        'constant_step_size': (ConstantStepSizeActionValueEstimator, {'num_actions': num_actions, 'alpha': 0.1})
     }
 
     epsilon_generator = epsilon_parameter_generator()
@@ -33,15 +34,15 @@ def run():
     steps = 200_000
     epochs = 10
 
+    # The cells save their progress every minute, so an interrupted sweep resumes inside its 200,000 step runs
+    sweep = ParameterSweep(cache_dir, checkpoint_every=60)
+    random_walk_action_reward = (RandomWalkActionReward, {'init_q_a': init_q_a, 'num_actions': num_actions})
+
     for (estimator_name, estimator), color in zip(estimators.items(), colors):
-        total_trailing_avg_rewards = []
-        for epsilon in epsilons:
-            random_walk_action_reward = RandomWalkActionReward(init_q_a, num_actions)
-            action_selector = GreedyActionSelector(estimator, epsilon)
-            runner = Runner(random_walk_action_reward, estimator, action_selector)
-            trailing_avg_reward = runner.run_epochs(epochs, steps, meter=1, aggregator='trailing_avg', trailing_steps=100_000)
-            print("trailing avg: {}".format(trailing_avg_reward))
-            total_trailing_avg_rewards.append(trailing_avg_reward)
+        cells = SweepCell.grid([random_walk_action_reward], [estimator], expand(GreedyActionSelector, epsilon=epsilons),
+                               epochs, steps, aggregator='trailing_avg', trailing_steps=100_000)
+        total_trailing_avg_rewards = sweep.run(cells)
+        print("trailing avg: {}".format(total_trailing_avg_rewards))
 
         plt.plot(epsilons, total_trailing_avg_rewards, color=color, label="estimator=" + estimator_name)
 
@@ -2,10 +2,10 @@
 
 import matplotlib.pyplot as plt
 
-from framework.action_selectors import GreedyActionSelector
-from framework.action_value_estimators import AverageRewardsEstimator, IncrementalRewardActionValueEstimator
-from framework.rewards import NormalDistributionReward
-from framework.runner import Runner
+from framework.action_selectors import BatchGreedyActionSelector
+from framework.action_value_estimators import BatchIncrementalRewardActionValueEstimator
+from framework.rewards import BatchNormalDistributionReward
+from framework.runner import BatchRunner
 
 
 def run():
@@ -20,10 +20,10 @@ def run():
     x = range(0, steps)
 
     for epsilon, color in zip(epsilons, colors):
-        normal_dist_reward = NormalDistributionReward(num_actions)
-        avg_reward_estimator = IncrementalRewardActionValueEstimator(num_actions)
-        action_selector = GreedyActionSelector(avg_reward_estimator, epsilon)
-        runner = Runner(normal_dist_reward, avg_reward_estimator, action_selector)
+        normal_dist_reward = BatchNormalDistributionReward(num_actions)
+        avg_reward_estimator = BatchIncrementalRewardActionValueEstimator(num_actions)
+        action_selector = BatchGreedyActionSelector(avg_reward_estimator, epsilon)
+        runner = BatchRunner(normal_dist_reward, avg_reward_estimator, action_selector)
         total_avg_rewards, optimal_action_pct = runner.run_epochs(epochs, steps)
         axs[0].plot(x, total_avg_rewards, color=color, label="epsilon=" + str(epsilon))
         axs[1].plot(x, optimal_action_pct, color=color, label="epsilon=" + str(epsilon))
@@ -0,0 +1,40 @@
+"""Checkpoints of the DP solvers: the values, the policy and the progress of a solve in one compressed .npz file. A
+**DPSolver** with a checkpoint path saves its progress while it runs and can resume an interrupted solve from it; the
+values and policy of a finished solve warm-start the solve of a nearby configuration."""
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# method: solver method that wrote the checkpoint; evaluation_sweeps: its setting, None for full evaluation;
+# config: dict describing the problem, e.g. the model parameters
+Checkpoint = namedtuple('Checkpoint', ['values', 'policy', 'sweeps', 'improvements', 'backups', 'method',
+                                       'evaluation_sweeps', 'complete', 'config'])
+
+
+def save_checkpoint(path, values, policy=None, sweeps=0, improvements=0, backups=0, method='', evaluation_sweeps=None,
+                    complete=False, config=None):
+    """
+    Writes the checkpoint to a temporary file first, so an interrupted save keeps the previous checkpoint.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, values=np.asarray(values, dtype=float),
+                            policy=np.full(len(values), -1) if policy is None else np.asarray(policy),
+                            counters=np.array([sweeps, improvements, backups,
+                                               -1 if evaluation_sweeps is None else evaluation_sweeps, complete]),
+                            method=np.array(method), config=np.array(json.dumps(config or {})))
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    :return: the **Checkpoint** saved at :path:
+    """
+    with np.load(path) as data:
+        sweeps, improvements, backups, evaluation_sweeps, complete = data['counters'].tolist()
+        return Checkpoint(data['values'], data['policy'], sweeps, improvements, backups, str(data['method']),
+                          None if evaluation_sweeps < 0 else evaluation_sweeps, bool(complete),
+                          json.loads(str(data['config'])))
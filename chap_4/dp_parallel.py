@@ -0,0 +1,75 @@
+"""Policy improvement on a pool of worker processes. Once the values are fixed, the greedy action of every state is
+independent of the others, so the states are split into chunks that the workers improve in parallel. The workers get
+the model once, when they start, and read the values from shared memory instead of receiving them with every task."""
+
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Model, gamma and the shared arrays of a worker process, set by _init_worker
+_worker = {}
+
+
+class ParallelImprover:
+    """
+    :param workers: number of worker processes, all cores if None
+    :param chunks_per_worker: the states are split into this many chunks per worker, to balance the load
+    """
+
+    def __init__(self, model, gamma, workers=None, chunks_per_worker=4):
+        self._num_states = model.num_states
+        self._values_memory = shared_memory.SharedMemory(create=True, size=model.num_states * 8)
+        self._values = np.ndarray(model.num_states, dtype=np.float64, buffer=self._values_memory.buf)
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                             initargs=(model, gamma, self._values_memory.name, model.num_states))
+        self._num_chunks = (workers or os.cpu_count() or 1) * chunks_per_worker
+        self._finalizer = weakref.finalize(self, _release, self._executor, self._values_memory)
+
+    def improve(self, values, states):
+        """
+        :param values: value of every state
+        :param states: indices of the states to improve
+        :return: greedy actions of the states
+        """
+        self._values[:] = values
+        chunks = np.array_split(np.asarray(states), min(self._num_chunks, max(1, len(states))))
+        return np.concatenate(list(self._executor.map(_improve_chunk, chunks))).astype(int, copy=False)
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _release(executor, values_memory):
+    executor.shutdown()
+    values_memory.close()
+    values_memory.unlink()
+
+
+def _init_worker(model, gamma, values_name, num_states):
+    values_memory = shared_memory.SharedMemory(name=values_name)
+    _worker.update({
+        'model': model,
+        'gamma': gamma,
+        'memory': values_memory,
+        'values': np.ndarray(num_states, dtype=np.float64, buffer=values_memory.buf)
+    })
+
+
+def _improve_chunk(states):
+    """
+    :return: greedy actions of the states
+    """
+    values = _worker['values'].astype(_worker['model'].dtype, copy=False)
+    return _worker['model'].greedy(values, _worker['gamma'], states)[1]
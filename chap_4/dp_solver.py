@@ -0,0 +1,464 @@
+"""Dynamic programming solvers for finite MDPs (chapter 4). A problem plugs in through **TabularModel**, which computes
+the action values of a set of states as array operations; the solvers offer value iteration, policy iteration and
+modified policy iteration with synchronous (Jacobi) or in-place (Gauss-Seidel) sweeps, and asynchronous value iteration
+with prioritized sweeping. All solve loops are iterative."""
+
+import heapq
+from abc import abstractmethod
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+from chap_4.dp_checkpoint import load_checkpoint, save_checkpoint
+from chap_4.dp_parallel import ParallelImprover
+
+# backups: number of single state Bellman backups computed; linear solves are not counted
+SolverResult = namedtuple('SolverResult', ['values', 'policy', 'sweeps', 'improvements', 'backups'])
+
+
+class TabularModel:
+    """
+    A finite MDP with states 0..num_states-1 and actions 0..num_actions-1. Invalid actions of a state have the value
+    -inf. Terminal states keep their value and have no action.
+    :tie_break: 'first' or 'last', which of the equally good actions is greedy
+    :dtype: dtype of the values the solvers keep
+    """
+
+    num_states = 0
+    num_actions = 0
+    tie_break = 'first'
+    dtype = np.float64
+
+    @abstractmethod
+    def q_values(self, values, gamma, states=None):
+        """
+        :param values: value of every state
+        :param states: indices of the states, all states if None
+        :return: (len(states), num_actions) array of action values
+        """
+        pass
+
+    def policy_values(self, values, gamma, policy, states=None):
+        """
+        :param policy: action of every state
+        :return: the value of taking the policy action in each of the states
+        """
+        if states is None:
+            states = np.arange(self.num_states)
+        return self.q_values(values, gamma, states)[np.arange(len(states)), policy[states]]
+
+    def greedy(self, values, gamma, states=None):
+        """
+        :return: (best action value, greedy action) of each of the states
+        """
+        q_values = self.q_values(values, gamma, states)
+        if self.tie_break == 'last':
+            actions = q_values.shape[1] - 1 - np.argmax(q_values[:, ::-1], axis=1)
+        else:
+            actions = np.argmax(q_values, axis=1)
+        return q_values[np.arange(len(actions)), actions], actions
+
+    def terminal_states(self):
+        """
+        :return: boolean mask of the terminal states
+        """
+        return np.zeros(self.num_states, dtype=bool)
+
+    @abstractmethod
+    def policy_transitions(self, policy, states):
+        """
+        Needed for evaluating a policy with a linear solve.
+        :return: (sparse (len(states), num_states) matrix of the transition probabilities under the policy, expected
+        reward of each of the states under the policy)
+        """
+        pass
+
+    def predecessors(self):
+        """
+        Needed for prioritized sweeping. Built from **policy_transitions** of every action, over the states where the
+        action is valid; models with a cheaper way override it.
+        :return: for every state, (array of the states whose backups use its value, i.e. that can reach it with one
+        action, array of their largest transition probabilities into it over the actions)
+        """
+        states = np.arange(self.num_states)
+        valid = np.isfinite(self.q_values(np.zeros(self.num_states, dtype=self.dtype), 0.0, states))
+        largest = sparse.csr_matrix((self.num_states, self.num_states))
+        for action in range(self.num_actions):
+            action_states = np.flatnonzero(valid[:, action])
+            if len(action_states) == 0:
+                continue
+            transitions = sparse.coo_matrix(self.policy_transitions(np.full(self.num_states, action),
+                                                                    action_states)[0])
+            largest = largest.maximum(sparse.csr_matrix(
+                (transitions.data, (action_states[transitions.row], transitions.col)),
+                shape=(self.num_states, self.num_states)))
+        largest = largest.tocsc()
+        largest.eliminate_zeros()
+        return [(largest.indices[largest.indptr[state]:largest.indptr[state + 1]],
+                 largest.data[largest.indptr[state]:largest.indptr[state + 1]]) for state in range(self.num_states)]
+
+
+class DPSolver:
+    """
+    :param sweep: 'jacobi' computes every sweep from the values of the previous sweep as one array operation;
+    'gauss_seidel' updates the states one by one in place, so later states already use the new values
+    :param threshold: sweeps stop once the largest value change is below it
+    :param evaluation: how a policy is evaluated to convergence. 'sweeps' repeats sweeps until the threshold;
+    'direct' solves the linear system (I - gamma P_pi) v = r_pi with a sparse LU factorization; 'iterative' solves it
+    with BiCGSTAB preconditioned by an incomplete LU factorization, to :solver_tolerance:. The linear solves need
+    **TabularModel.policy_transitions**.
+    :param trace: **SolverTrace** that records every sweep, linear solve and improvement, if given
+    :param checkpoint: path of a checkpoint that the solves save to every :checkpoint_every: sweeps, after every
+    improvement and when they finish, see **resume**
+    :param workers: number of processes that improve the policy, see **ParallelImprover**; 1 improves it in this
+    process, None uses all cores. The workers are started on the first improvement and stopped by **close**.
+    """
+
+    def __init__(self, model, gamma=0.9, threshold=1e-10, sweep='jacobi', evaluation='sweeps',
+                 solver_tolerance=1e-10, trace=None, checkpoint=None, checkpoint_every=10, workers=1):
+        if sweep not in ('jacobi', 'gauss_seidel'):
+            raise ValueError("Unknown sweep: {}".format(sweep))
+        if evaluation not in ('sweeps', 'direct', 'iterative'):
+            raise ValueError("Unknown evaluation: {}".format(evaluation))
+        self._model = model
+        self._gamma = gamma
+        self._threshold = threshold
+        self._sweep = sweep
+        self._evaluation = evaluation
+        self._solver_tolerance = solver_tolerance
+        self._trace = trace
+        self._checkpoint = checkpoint
+        self._checkpoint_every = checkpoint_every
+        self._workers = workers
+        self._improver = None
+        self._terminal = model.terminal_states()
+        self._states = np.flatnonzero(~self._terminal)
+        self._predecessors = None
+
+    def value_iteration(self, values):
+        """
+        :param values: initial values, e.g. the values of a nearby problem to warm-start; terminal states keep theirs
+        :return: **SolverResult** with the optimal values and the greedy policy
+        """
+        return self._value_iteration(np.array(values, dtype=self._model.dtype), 0)
+
+    def _value_iteration(self, values, sweeps):
+        while True:
+            started = self._trace.clock() if self._trace else None
+            delta = self._value_sweep(values)
+            sweeps += 1
+            if self._trace:
+                self._trace.record('value_sweep', started, delta, len(self._states), values=values)
+            if delta < self._threshold:
+                break
+            if self._checkpoint and sweeps % self._checkpoint_every == 0:
+                self._save('value_iteration', values, None, sweeps, 0, sweeps * len(self._states))
+        result = SolverResult(values, self.improve_policy(values), sweeps, 1, (sweeps + 1) * len(self._states))
+        self._save_result('value_iteration', result)
+        return result
+
+    def resume(self, checkpoint=None):
+        """
+        Continues the solve that saved the checkpoint, or returns its result if it had finished. Prioritized sweeping
+        restarts from the saved values with a synchronous sweep, since its queue is not saved, and runs until it
+        converges.
+        :param checkpoint: path of the checkpoint, the one of the solver by default
+        :return: **SolverResult** of the whole solve, counting the sweeps before the checkpoint
+        :raise ValueError: if the checkpoint was written by an unknown method or by a solver with another configuration
+        """
+        saved = load_checkpoint(checkpoint or self._checkpoint)
+        if len(saved.values) != self._model.num_states:
+            raise ValueError("Checkpoint has {} states, the model {}".format(len(saved.values), self._model.num_states))
+        if saved.method not in ('value_iteration', 'prioritized_value_iteration', 'modified_policy_iteration'):
+            raise ValueError("Unknown method of the checkpoint: {!r}".format(saved.method))
+        config = self._config()
+        mismatched = sorted(key for key in config if key in saved.config and saved.config[key] != config[key])
+        if mismatched:
+            raise ValueError("Checkpoint was saved with another configuration: " + ", ".join(
+                "{} {!r}, not {!r}".format(key, saved.config[key], config[key]) for key in mismatched))
+        if saved.complete:
+            return SolverResult(saved.values, saved.policy, saved.sweeps, saved.improvements, saved.backups)
+        if saved.method == 'value_iteration':
+            return self._value_iteration(saved.values, saved.sweeps)
+        if saved.method == 'prioritized_value_iteration':
+            return self._prioritized_value_iteration(saved.values, None, saved.backups, saved.sweeps)
+        return self._modified_policy_iteration(saved.values, saved.policy, saved.evaluation_sweeps, saved.sweeps,
+                                               saved.improvements, saved.backups)
+
+    def prioritized_value_iteration(self, values, max_backups=None, batch_size=64):
+        """
+        Asynchronous value iteration that always backs up the states with the largest priorities. A priority is an upper
+        bound of the Bellman error of the state: after a first synchronous sweep it is increased by
+        gamma * P(s' | s, a) * |change of s'| whenever a successor s' changes (see **TabularModel.predecessors**), so
+        states whose successors have converged are not backed up again. Stops when all priorities are below the
+        threshold.
+        :param max_backups: stops after this many backups even if some priorities are still above the threshold
+        :param batch_size: states popped from the queue and backed up together, with one call of
+        **TabularModel.greedy**. The states of a batch are backed up from the same values, so larger batches need a
+        few more backups to converge but spend much less time per backup.
+        :return: **SolverResult** with the values and the greedy policy; sweeps is the number of state updates. A trace
+        gets a row whenever the backups pass a multiple of the number of states and one for the backups left over at the
+        end; a checkpoint is saved whenever they pass a multiple of :checkpoint_every: times the number of states.
+        """
+        return self._prioritized_value_iteration(np.array(values, dtype=self._model.dtype), max_backups, 0, 0,
+                                                 batch_size)
+
+    def _prioritized_value_iteration(self, values, max_backups, backups, updates, batch_size=64):
+        predecessors = self._get_predecessors()
+        priorities = np.zeros(self._model.num_states)
+        queue = []
+
+        # Start with one synchronous sweep, which leaves errors only where successors changed
+        started = self._trace.clock() if self._trace else None
+        new_values = self._model.greedy(values, self._gamma, self._states)[0]
+        changes = np.abs(new_values - values[self._states])
+        values[self._states] = new_values
+        self._raise_priorities(queue, priorities, predecessors, self._states[changes > 0].tolist(),
+                               changes[changes > 0].tolist())
+        backups += len(self._states)
+        updates += len(self._states)
+        if self._trace:
+            self._trace.record('value_sweep', started, changes.max(initial=0.0), backups, values=values)
+            started = self._trace.clock()
+        block_delta = 0.0
+
+        recorded = saved = backups
+        checkpoint_backups = self._checkpoint_every * len(self._states)
+        while queue and (max_backups is None or backups < max_backups):
+            # Back up the states with the largest priorities together, one call of the model per batch
+            size = batch_size if max_backups is None else min(batch_size, max_backups - backups)
+            batch = []
+            while queue and len(batch) < size:
+                priority, state = heapq.heappop(queue)
+                if -priority != priorities[state]:
+                    # Stale entry, the priority of the state was raised after it was queued
+                    continue
+                priorities[state] = 0.0
+                batch.append(state)
+            if not batch:
+                break
+            batch = np.array(batch)
+            new_values = self._model.greedy(values, self._gamma, batch)[0]
+            backups += len(batch)
+            changes = np.abs(new_values - values[batch])
+            changed = changes > 0.0
+            values[batch[changed]] = new_values[changed]
+            updates += int(changed.sum())
+            self._raise_priorities(queue, priorities, predecessors, batch[changed].tolist(), changes[changed].tolist())
+            block_delta = max(block_delta, changes.max())
+            if self._trace and backups // len(self._states) > recorded // len(self._states):
+                self._trace.record('prioritized', started, block_delta, backups - recorded, values=values)
+                started = self._trace.clock()
+                recorded = backups
+                block_delta = 0.0
+            if self._checkpoint and backups // checkpoint_backups > saved // checkpoint_backups:
+                self._save('prioritized_value_iteration', values, None, updates, 0, backups)
+                saved = backups
+        if self._trace and backups > recorded:
+            self._trace.record('prioritized', started, block_delta, backups - recorded, values=values)
+
+        result = SolverResult(values, self.improve_policy(values), updates, 1, backups + len(self._states))
+        self._save_result('prioritized_value_iteration', result)
+        return result
+
+    def policy_iteration(self, values, policy):
+        """
+        Evaluates the policy until the values converge, then improves it, until the policy is stable.
+        :return: **SolverResult** with the values and the stable policy
+        """
+        return self.modified_policy_iteration(values, policy, evaluation_sweeps=None)
+
+    def modified_policy_iteration(self, values, policy, evaluation_sweeps=5):
+        """
+        Evaluates the policy with at most :evaluation_sweeps: sweeps (until convergence if None) before improving it.
+        Stops when the policy is stable and the values have converged.
+        :return: **SolverResult** with the values and the stable policy
+        """
+        return self._modified_policy_iteration(np.array(values, dtype=self._model.dtype), np.array(policy),
+                                               evaluation_sweeps, 0, 0, 0)
+
+    def _modified_policy_iteration(self, values, policy, evaluation_sweeps, sweeps, improvements, backups):
+        while True:
+            evaluation_delta, evaluation_sweeps_done = self.evaluate_policy(values, policy, evaluation_sweeps)
+            sweeps += evaluation_sweeps_done
+            if self._evaluation == 'sweeps' or evaluation_sweeps is not None:
+                backups += evaluation_sweeps_done * len(self._states)
+            started = self._trace.clock() if self._trace else None
+            new_policy = self.improve_policy(values)
+            improvements += 1
+            backups += len(self._states)
+            policy_changes = np.count_nonzero(new_policy[self._states] != policy[self._states])
+            if self._trace:
+                self._trace.record('improvement', started, backups=len(self._states), policy_changes=policy_changes)
+            policy_stable = policy_changes == 0
+            policy = new_policy
+            if policy_stable and evaluation_delta < self._threshold:
+                break
+            if self._checkpoint:
+                self._save('modified_policy_iteration', values, policy, sweeps, improvements, backups,
+                           evaluation_sweeps)
+        result = SolverResult(values, policy, sweeps, improvements, backups)
+        self._save_result('modified_policy_iteration', result, evaluation_sweeps)
+        return result
+
+    def evaluate_policy(self, values, policy, max_sweeps=None):
+        """
+        Updates :values: in place with the values of the policy. Uses a linear solve instead of sweeps if configured
+        and :max_sweeps: is None.
+        :return: (largest value change of the last sweep, number of sweeps); a linear solve counts as one sweep with
+        no change left
+        """
+        if self._evaluation != 'sweeps' and max_sweeps is None:
+            started = self._trace.clock() if self._trace else None
+            self._solve_policy_values(values, policy)
+            if self._trace:
+                self._trace.record('linear_solve', started, values=values)
+            return 0.0, 1
+
+        sweeps = 0
+        while True:
+            started = self._trace.clock() if self._trace else None
+            delta = self._evaluation_sweep(values, policy)
+            sweeps += 1
+            if self._trace:
+                self._trace.record('evaluation_sweep', started, delta, len(self._states), values=values)
+            if delta < self._threshold or (max_sweeps is not None and sweeps >= max_sweeps):
+                return delta, sweeps
+
+    def improve_policy(self, values):
+        """
+        :return: the greedy policy of the values; -1 for terminal states
+        """
+        new_policy = np.full(self._model.num_states, -1)
+        if self._workers == 1:
+            new_policy[self._states] = self._model.greedy(values, self._gamma, self._states)[1]
+            return new_policy
+
+        if self._improver is None:
+            self._improver = ParallelImprover(self._model, self._gamma, self._workers)
+        new_policy[self._states] = self._improver.improve(values, self._states)
+        return new_policy
+
+    def close(self):
+        """
+        Stops the improvement workers, if any.
+        """
+        if self._improver is not None:
+            self._improver.close()
+            self._improver = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _config(self):
+        """
+        :return: the settings a checkpoint of the solver is only valid for
+        """
+        return {'num_states': self._model.num_states, 'num_actions': self._model.num_actions, 'gamma': self._gamma,
+                'threshold': self._threshold, 'sweep': self._sweep, 'evaluation': self._evaluation}
+
+    def _save(self, method, values, policy, sweeps, improvements, backups, evaluation_sweeps=None, complete=False):
+        save_checkpoint(self._checkpoint, values, policy, sweeps, improvements, backups, method, evaluation_sweeps,
+                        complete, self._config())
+
+    def _save_result(self, method, result, evaluation_sweeps=None):
+        if self._checkpoint:
+            self._save(method, result.values, result.policy, result.sweeps, result.improvements, result.backups,
+                       evaluation_sweeps, complete=True)
+
+    def _get_predecessors(self):
+        """
+        :return: the non-terminal predecessors of every state with their largest transition probabilities into it,
+        computed once
+        """
+        if self._predecessors is None:
+            self._predecessors = []
+            for states, probabilities in self._model.predecessors():
+                non_terminal = ~self._terminal[states]
+                self._predecessors.append((states[non_terminal], probabilities[non_terminal]))
+        return self._predecessors
+
+    def _raise_priorities(self, queue, priorities, predecessors, states, changes):
+        """
+        Raises the priorities of the predecessors of all :states: at once, by the :changes: of their values, and queues
+        the predecessors whose priority reached the threshold.
+        """
+        if len(states) == 0:
+            return
+        raised_states = np.concatenate([predecessors[state][0] for state in states])
+        increments = np.concatenate([predecessors[state][1] * change for state, change in zip(states, changes)])
+        increments = np.bincount(raised_states, increments, minlength=len(priorities))
+        raised_states = np.flatnonzero(increments)
+        raised = priorities[raised_states] + self._gamma * increments[raised_states]
+        priorities[raised_states] = raised
+        queued = raised >= self._threshold
+        entries = list(zip((-raised[queued]).tolist(), raised_states[queued].tolist()))
+        if len(queue) + len(entries) > 4 * self._model.num_states:
+            # Too many stale entries, rebuild the queue from the current priorities
+            raised_states = np.flatnonzero(priorities >= self._threshold)
+            queue[:] = zip((-priorities[raised_states]).tolist(), raised_states.tolist())
+            heapq.heapify(queue)
+        elif len(entries) > len(queue) // 8:
+            # Pushing costs O(log n) per entry, heapify O(n) for the whole queue
+            queue.extend(entries)
+            heapq.heapify(queue)
+        else:
+            for entry in entries:
+                heapq.heappush(queue, entry)
+
+    def _value_sweep(self, values):
+        if self._sweep == 'jacobi':
+            new_values = self._model.greedy(values, self._gamma, self._states)[0]
+            delta = np.abs(new_values - values[self._states]).max(initial=0.0)
+            values[self._states] = new_values
+            return delta
+
+        delta = 0.0
+        for state in self._states:
+            new_value = self._model.greedy(values, self._gamma, [state])[0][0]
+            delta = max(delta, abs(new_value - values[state]))
+            values[state] = new_value
+        return delta
+
+    def _evaluation_sweep(self, values, policy):
+        if self._sweep == 'jacobi':
+            new_values = self._model.policy_values(values, self._gamma, policy, self._states)
+            delta = np.abs(new_values - values[self._states]).max(initial=0.0)
+            values[self._states] = new_values
+            return delta
+
+        delta = 0.0
+        for state in self._states:
+            new_value = self._model.policy_values(values, self._gamma, policy, np.array([state]))[0]
+            delta = max(delta, abs(new_value - values[state]))
+            values[state] = new_value
+        return delta
+
+    def _solve_policy_values(self, values, policy):
+        """
+        Solves (I - gamma P_TT) v_T = r_T + gamma P_Tt v_t for the values v_T of the non-terminal states, where the
+        terminal states t keep their values.
+        """
+        transitions, rewards = self._model.policy_transitions(policy, self._states)
+        transitions = sparse.csr_matrix(transitions)
+        terminal_states = np.flatnonzero(self._terminal)
+        right_hand_side = rewards + self._gamma * (transitions[:, terminal_states] @ values[terminal_states])
+        system = (sparse.identity(len(self._states), format='csc') -
+                  self._gamma * transitions[:, self._states].tocsc())
+
+        if self._evaluation == 'direct':
+            values[self._states] = sparse_linalg.spsolve(system, right_hand_side)
+            return
+
+        incomplete_lu = sparse_linalg.spilu(system)
+        preconditioner = sparse_linalg.LinearOperator(system.shape, incomplete_lu.solve)
+        solution, info = sparse_linalg.bicgstab(system, right_hand_side, x0=values[self._states],
+                                                rtol=self._solver_tolerance, M=preconditioner)
+        if info != 0:
+            raise RuntimeError("Policy evaluation did not converge: bicgstab returned {}".format(info))
+        values[self._states] = solution
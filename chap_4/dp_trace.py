@@ -0,0 +1,121 @@
+"""Convergence traces of the DP solvers. A **SolverTrace** passed to **DPSolver** records one row per sweep, linear
+solve and policy improvement into a preallocated buffer, with no formatting or I/O during the solve, and exports the
+rows to CSV or JSON afterwards."""
+
+import csv
+import json
+import time
+
+import numpy as np
+
+KINDS = ('value_sweep', 'evaluation_sweep', 'linear_solve', 'prioritized', 'improvement')
+
+# improvement: round of policy iteration the row belongs to, counted from 0; sweep: sweeps and solves so far
+RECORD_DTYPE = np.dtype([
+    ('kind', np.int8),
+    ('improvement', np.int64),
+    ('sweep', np.int64),
+    ('max_delta', np.float64),
+    ('seconds', np.float64),
+    ('backups', np.int64),
+    ('policy_changes', np.int64)
+])
+
+
+class SolverTrace:
+    """
+    :param capacity: rows allocated up front; the buffer doubles when it is full
+    :param sample_states: indices of states whose values are recorded too, none by default
+    :param sample_every: records the values of :sample_states: every :sample_every: rows
+    """
+
+    def __init__(self, capacity=1024, sample_states=None, sample_every=1):
+        self._records = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self._size = 0
+        self._improvement = 0
+        self._sweep = 0
+        self._sample_states = None if sample_states is None else np.asarray(sample_states)
+        self._sample_every = sample_every
+        self._sample_rows = []
+        self._samples = []
+
+    def clock(self):
+        return time.perf_counter()
+
+    def record(self, kind, started, max_delta=np.nan, backups=0, policy_changes=-1, values=None):
+        """
+        Adds a row for a sweep, linear solve or improvement that started at :started: (see **clock**).
+        :param kind: one of **KINDS**
+        :param values: current values, sampled if the trace has sample states
+        """
+        seconds = time.perf_counter() - started
+        if self._size == len(self._records):
+            self._records = np.concatenate([self._records, np.zeros(len(self._records), dtype=RECORD_DTYPE)])
+        if kind != 'improvement':
+            self._sweep += 1
+        self._records[self._size] = (KINDS.index(kind), self._improvement, self._sweep, max_delta, seconds, backups,
+                                     policy_changes)
+        if kind == 'improvement':
+            self._improvement += 1
+        if self._sample_states is not None and values is not None and self._size % self._sample_every == 0:
+            self._sample_rows.append(self._size)
+            self._samples.append(values[self._sample_states].copy())
+        self._size += 1
+
+    def get_records(self):
+        """
+        :return: structured array of the recorded rows, see **RECORD_DTYPE**
+        """
+        return self._records[:self._size]
+
+    def get_samples(self):
+        """
+        :return: (row of every sample, (samples, len(sample_states)) array of the sampled values)
+        """
+        if not self._samples:
+            num_sample_states = 0 if self._sample_states is None else len(self._sample_states)
+            return np.array([], dtype=int), np.empty((0, num_sample_states))
+        return np.array(self._sample_rows), np.stack(self._samples)
+
+    def to_dicts(self):
+        """
+        :return: one dict per row, with the kind as a name, backups per second and the sampled values if any
+        """
+        samples = dict(zip(*self.get_samples()))
+        rows = []
+        for index, record in enumerate(self.get_records()):
+            row = {
+                'kind': KINDS[record['kind']],
+                'improvement': int(record['improvement']),
+                'sweep': int(record['sweep']),
+                'max_delta': None if np.isnan(record['max_delta']) else float(record['max_delta']),
+                'seconds': float(record['seconds']),
+                'backups': int(record['backups']),
+                'backups_per_sec': float(record['backups'] / record['seconds']) if record['seconds'] else 0.0,
+                'policy_changes': None if record['policy_changes'] < 0 else int(record['policy_changes'])
+            }
+            if index in samples:
+                row['samples'] = dict(zip(self._sample_states.tolist(), samples[index].tolist()))
+            rows.append(row)
+        return rows
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dicts(), f, indent=2)
+
+    def to_csv(self, path):
+        """
+        Writes one line per row; sampled values go to one column per sample state, empty where not sampled.
+        """
+        sample_columns = [] if self._sample_states is None else \
+            ['state_{}'.format(state) for state in self._sample_states.tolist()]
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['kind', 'improvement', 'sweep', 'max_delta', 'seconds', 'backups', 'backups_per_sec',
+                             'policy_changes'] + sample_columns)
+            for row in self.to_dicts():
+                samples = row.pop('samples', {})
+                line = ['' if value is None else value for value in row.values()]
+                if sample_columns:
+                    line += [samples.get(state, '') for state in self._sample_states.tolist()]
+                writer.writerow(line)
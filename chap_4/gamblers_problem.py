@@ -1,7 +1,12 @@
 import numpy as np
 import logging
 import sys
-import matplotlib.pyplot as plt
+from collections import namedtuple
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import sparse
+
+from chap_4.dp_checkpoint import load_checkpoint
+from chap_4.dp_solver import DPSolver, TabularModel
 
 np.random.seed()
 
@@ -14,26 +19,39 @@ class TerminationException:
         self.reward = reward
 
 
-class GamblerPolicy:
+class GamblerPolicy(TabularModel):
     """
-    States: s \in [1, 99]
-    Actions: a \in [0, min(s, 100 - s)]
+    States: s \in [1, goal - 1]
+    Actions: a \in [0, min(s, goal - s)]
+    Action index a of the **TabularModel** is the stake a; ties go to the largest stake.
+
+    Backups of a range of states read the values of all their stakes through sliding window views over the value
+    array, :chunk_elements: (state, stake) pairs at a time, so large goals need memory for one chunk only.
+    :param dtype: dtype of the values, e.g. np.float32 to halve the memory and the bandwidth of large goals
     """
 
-    def __init__(self, p_head):
-        self.states = range(0, 101)
-        self._actions = lambda s: range(1, min(s, 100 - s) + 1)
+    tie_break = 'last'
+
+    def __init__(self, p_head, goal=100, dtype=np.float64, chunk_elements=1 << 22):
+        self.states = range(0, goal + 1)
+        self._actions = lambda s: range(1, min(s, goal - s) + 1)
         self._p_head = p_head
+        self.goal = goal
+        self.dtype = np.dtype(dtype).type
+        self._chunk_elements = chunk_elements
+        self.num_states = goal + 1
+        self.num_actions = goal // 2 + 1
 
     def prob(self, state, action):
         """
         Given the state and action, return the probability of next step and corresponding rewards.
-        There are two cases: head -> next_state = min(100, state + action) or tail -> next_state = max(0, state - action)
+        There are two cases: head -> next_state = min(goal, state + action) or
+        tail -> next_state = max(0, state - action)
         :param state: current state
         :param action: current action
         :return: (next_state, probability, reward)
         """
-        if state + action == 100:
+        if state + action == self.goal:
             reward = 1
         else:
             reward = 0
@@ -43,49 +61,221 @@ class GamblerPolicy:
     def get_eligible_actions(self, state):
         return self._actions(state)
 
-    @staticmethod
-    def is_terminal_state(state):
-        return state in [0, 100]
+    def is_terminal_state(self, state):
+        return state in [0, self.goal]
+
+    def q_values(self, values, gamma, states=None):
+        """
+        Same backup as **prob** for all stakes of the states at once.
+        """
+        states = np.arange(self.num_states) if states is None else np.asarray(states)
+        stakes = np.arange(self.num_actions)
+        wins = states[:, None] + stakes
+        losses = states[:, None] - stakes
+        valid = (stakes >= 1) & (stakes <= np.minimum(states, self.goal - states)[:, None])
+
+        q_values = self._p_head * ((wins == self.goal) + gamma * values[np.clip(wins, 0, self.goal)]) + \
+            (1 - self._p_head) * (gamma * values[np.clip(losses, 0, self.goal)])
+        q_values[~valid] = -np.inf
+        return q_values
+
+    def greedy(self, values, gamma, states=None):
+        """
+        Backs up a contiguous range of states in chunks of strided window views, other states with **q_values**.
+        """
+        states = np.arange(self.num_states) if states is None else np.asarray(states)
+        if len(states) < 2 or np.any(np.diff(states) != 1):
+            return super().greedy(values, gamma, states)
+
+        # Padded so that the windows of all stakes stay inside the buffer: forward[max_stake + s, a] = V[s + a] and
+        # backward[length - 1 - max_stake - s, a] = V[s - a]
+        max_stake = self.num_actions - 1
+        padded = np.zeros(self.num_states + 2 * max_stake, dtype=self.dtype)
+        padded[max_stake:max_stake + self.num_states] = values
+        forward = sliding_window_view(padded, max_stake + 1)
+        backward = sliding_window_view(padded[::-1], max_stake + 1)
+        p_head = self.dtype(self._p_head)
+        gamma = self.dtype(gamma)
+
+        best_values = np.empty(len(states), dtype=self.dtype)
+        actions = np.empty(len(states), dtype=int)
+        chunk_states = max(1, self._chunk_elements // (max_stake + 1))
+        for start in range(0, len(states), chunk_states):
+            first, last = states[start], states[min(start + chunk_states, len(states)) - 1]
+            chunk = np.arange(first, last + 1)
+            max_stakes = np.minimum(chunk, self.goal - chunk)
+            width = int(max_stakes.max(initial=0)) + 1
+            stakes = np.arange(width)
+
+            wins = forward[max_stake + first:max_stake + last + 1, :width]
+            losses = backward[len(padded) - max_stake - last - 1:len(padded) - max_stake - first, :width][::-1]
+            q_values = wins * (p_head * gamma)
+            q_values += losses * ((1 - p_head) * gamma)
+            winning = np.flatnonzero(self.goal - chunk < width)
+            q_values[winning, self.goal - chunk[winning]] += p_head
+            q_values[:, 0] = -np.inf
+            q_values[stakes > max_stakes[:, None]] = -np.inf
+
+            chunk_actions = width - 1 - np.argmax(q_values[:, ::-1], axis=1)
+            actions[start:start + len(chunk)] = chunk_actions
+            best_values[start:start + len(chunk)] = q_values[np.arange(len(chunk)), chunk_actions]
+        return best_values, actions
+
+    def policy_transitions(self, policy, states):
+        states = np.asarray(states)
+        stakes = policy[states]
+        rows = np.arange(len(states))
+        transitions = sparse.csr_matrix(
+            (np.concatenate([np.full(len(states), self._p_head), np.full(len(states), 1 - self._p_head)]),
+             (np.concatenate([rows, rows]), np.concatenate([states + stakes, states - stakes]))),
+            shape=(len(states), self.num_states))
+        rewards = self._p_head * (states + stakes == self.goal)
+        return transitions, rewards
+
+    def predecessors(self):
+        """
+        State s backs up the states s + a, with the head probability, and s - a, with the tail probability, for the
+        stakes 1 <= a <= min(s, goal - s). Only these pairs are built, as a sparse matrix.
+        """
+        states = np.arange(self.num_states)
+        max_stakes = np.minimum(states, self.goal - states)
+        sources = np.tile(np.repeat(states, max_stakes), 2)
+        stakes = np.concatenate([np.arange(1, max_stake + 1) for max_stake in max_stakes])
+        stakes = np.concatenate([stakes, -stakes])
+        uses = sparse.csc_matrix(
+            (np.where(stakes > 0, self._p_head, 1 - self._p_head), (sources, sources + stakes)),
+            shape=(self.num_states, self.num_states))
+        return [(uses.indices[uses.indptr[state]:uses.indptr[state + 1]],
+                 uses.data[uses.indptr[state]:uses.indptr[state + 1]]) for state in states]
+
+    def terminal_states(self):
+        terminal = np.zeros(self.num_states, dtype=bool)
+        terminal[[0, self.goal]] = True
+        return terminal
+
+
+# values, policy: (num_params, goal + 1) arrays, one row per head probability; sweeps: sweeps until each converged
+BatchSolverResult = namedtuple('BatchSolverResult', ['p_heads', 'values', 'policy', 'sweeps', 'converged'])
+
+
+class BatchGamblerSolver:
+    """
+    Value iteration of the gambler's problem for many head probabilities at once. Every sweep backs up all states of
+    all head probabilities that have not converged yet as one array operation over the (state, stake) pairs that are
+    allowed; a head probability stops sweeping once its largest value change is below the threshold. Ties go to the
+    largest stake, as in **GamblerPolicy**.
+    :param p_heads: head probabilities to solve
+    :param goal: capital that wins; states are 0..goal, 0 and goal are terminal
+    """
+
+    def __init__(self, p_heads, goal=100, gamma=1.0, threshold=1e-10):
+        self._p_heads = np.asarray(p_heads, dtype=float)
+        self._goal = goal
+        self._gamma = gamma
+        self._threshold = threshold
+
+        # Stakes 1..min(s, goal - s) of every non-terminal state s, flattened state by state
+        states = np.arange(1, goal)
+        max_stakes = np.minimum(states, goal - states)
+        self._starts = np.concatenate([[0], np.cumsum(max_stakes)[:-1]])
+        self._stakes = np.arange(max_stakes.sum()) - np.repeat(self._starts, max_stakes) + 1
+        pair_states = np.repeat(states, max_stakes)
+        self._wins = pair_states + self._stakes
+        self._losses = pair_states - self._stakes
+        self._win_rewards = (self._wins == goal).astype(float)
+
+    def solve(self, values=None, max_sweeps=None):
+        """
+        :param values: initial values, one row per head probability or one row for all; zero by default. The terminal
+        states keep theirs.
+        :param max_sweeps: stops the head probabilities that have not converged after this many sweeps
+        :return: **BatchSolverResult**; policy is -1 for terminal states
+        """
+        num_params = len(self._p_heads)
+        if values is None:
+            values = np.zeros((num_params, self._goal + 1))
+        else:
+            values = np.array(np.broadcast_to(values, (num_params, self._goal + 1)), dtype=float)
+        sweeps = np.zeros(num_params, dtype=int)
+        active = np.arange(num_params)
+
+        while len(active) and (max_sweeps is None or sweeps[active[0]] < max_sweeps):
+            new_values = np.maximum.reduceat(self._q_values(values[active], self._p_heads[active]), self._starts,
+                                             axis=1)
+            deltas = np.abs(new_values - values[active, 1:-1]).max(axis=1)
+            values[active, 1:-1] = new_values
+            sweeps[active] += 1
+            active = active[deltas >= self._threshold]
+
+        converged = np.ones(num_params, dtype=bool)
+        converged[active] = False
+
+        q_values = np.full((num_params, self._goal - 1, self._goal // 2 + 1), -np.inf)
+        q_values[:, np.repeat(np.arange(self._goal - 1), np.diff(np.append(self._starts, len(self._stakes)))),
+                 self._stakes] = self._q_values(values, self._p_heads)
+        policy = np.full((num_params, self._goal + 1), -1)
+        policy[:, 1:-1] = q_values.shape[2] - 1 - np.argmax(q_values[:, :, ::-1], axis=2)
+        return BatchSolverResult(self._p_heads, values, policy, sweeps, converged)
+
+    def _q_values(self, values, p_heads):
+        """
+        :return: (len(p_heads), number of (state, stake) pairs) action values
+        """
+        p_heads = p_heads[:, None]
+        return p_heads * (self._win_rewards + self._gamma * values[:, self._wins]) + \
+            (1 - p_heads) * (self._gamma * values[:, self._losses])
 
 
 class PolicyIteration:
-    def __init__(self, gambler_policy, threshold=1e-10, gamma=0.95):
+    """
+    :param prioritized: if True, backs up the states in the order of their Bellman errors instead of sweeping them all
+    :param sweep: 'jacobi' backs up all states of a sweep at once with the strided window views of **GamblerPolicy**;
+    'gauss_seidel' updates the states one by one in place, which is only practical for small goals. See **DPSolver**
+    :param trace: **SolverTrace** that records the convergence, if given
+    :param checkpoint: path the solver saves its progress to, see **DPSolver**
+    """
+
+    def __init__(self, gambler_policy, threshold=1e-10, gamma=0.95, prioritized=False, sweep='jacobi', trace=None,
+                 checkpoint=None):
         self._threshold = threshold
+        self._prioritized = prioritized
+        self._sweep = sweep
+        self._trace = trace
+        self._checkpoint = checkpoint
         self._gamma = gamma
         self._gambler_policy = gambler_policy
         self.state_value = {state: np.random.rand() for state in gambler_policy.states}
         # Terminal state has value 0
         self.state_value[0] = 0
-        self.state_value[100] = 1
+        self.state_value[gambler_policy.goal] = 1
         self.policy = dict()
 
+    def warm_start(self, checkpoint):
+        """
+        Starts from the values of a checkpoint instead of random values, e.g. the solution for a nearby p_head.
+        """
+        values = load_checkpoint(checkpoint).values
+        if len(values) != self._gambler_policy.num_states:
+            raise ValueError("Checkpoint has {} states, the model {}".format(len(values),
+                                                                           self._gambler_policy.num_states))
+        self.state_value = dict(zip(self._gambler_policy.states, values.tolist()))
+
     def improve_policy(self):
-        epoch = 0
-        while True:
-            delta = 0
-            for state, value in self.state_value.items():
-                if self._gambler_policy.is_terminal_state(state):
-                    # Skip terminal states
-                    continue
-
-                new_value = 0
-                for action in self._gambler_policy.get_eligible_actions(state):
-                    proposed_value = sum([prob * (reward + self._gamma * self.state_value[next_state])
-                                          for next_state, prob, reward in self._gambler_policy.prob(state, action)])
-                    if proposed_value >= new_value:
-                        # Update the policy, so that we can get optimal policy directly
-                        new_value = proposed_value
-                        self.policy[state] = action
-
-                logger.debug("State {} changing from {} to {}".format(state, value, new_value))
-                self.state_value[state] = new_value
-                delta = max(delta, abs(new_value - value))
-
-            if delta < self._threshold:
-                break
-            else:
-                epoch += 1
-                logger.debug("############# Epoch {} #############".format(epoch))
+        """
+        Value iteration with the sweeps of :sweep:, or prioritized sweeping, keeping the greedy policy.
+        """
+        solver = DPSolver(self._gambler_policy, self._gamma, self._threshold, sweep=self._sweep, trace=self._trace,
+                          checkpoint=self._checkpoint)
+        states = list(self.state_value.keys())
+        initial_values = [self.state_value[state] for state in states]
+        if self._prioritized:
+            result = solver.prioritized_value_iteration(initial_values)
+        else:
+            result = solver.value_iteration(initial_values)
+
+        self.state_value = dict(zip(states, result.values.tolist()))
+        self.policy = {state: int(action) for state, action in zip(states, result.policy)
+                       if not self._gambler_policy.is_terminal_state(state)}
 
     def get_optimal_policy(self):
         self.improve_policy()
@@ -93,6 +283,9 @@ class PolicyIteration:
 
 
 if __name__ == "__main__":
+    # Only needed for the plots, so that the solvers can be imported without matplotlib
+    import matplotlib.pyplot as plt
+
     gambler_policy = GamblerPolicy(0.4)
     policy_iteration = PolicyIteration(gambler_policy, gamma=1)
     optimal_policy = policy_iteration.get_optimal_policy()
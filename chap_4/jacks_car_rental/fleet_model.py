@@ -0,0 +1,216 @@
+"""Jack's car rental generalized to any number of locations on a chain, with configurable limits and rates. Each
+location can move cars overnight to its neighbours on the chain. The state space has prod(max_cars + 1) states, so the
+model never builds arrays over states x actions x states: states are plain integer indices, and the transitions are
+kept as one sparse kernel per location. Backups apply the kernels along the axes of the value grid (see
+**separable_expectation**), which costs O(n^(N+1)) per sweep for N locations of n cars, for all states and actions."""
+
+import itertools
+
+import numpy as np
+from scipy import sparse
+from scipy.stats import poisson
+
+from chap_4.dp_solver import TabularModel
+from chap_4.jacks_car_rental.rental_model import separable_expectation, separable_expectation_at
+
+
+class FleetRentalModel(TabularModel):
+    """
+    Rentals and returns at every location are Poisson. Unlike **RentalModel**, every kernel is a proper distribution:
+    a location rents at most the cars it has, and the cars above :max_cars: at the end of the day are dropped. Requests
+    and returns are truncated where the Poisson tail is below :tail_tolerance:, and the tail is counted as the
+    truncation point. Every row of a kernel is then off by at most 2 * :tail_tolerance: in total variation, and the
+    kernels only keep a narrow band around the diagonal.
+
+    States are the integer index of the cars at each location, in C order (see **state_index**). Actions are the
+    numbers of cars moved on each route i -> i + 1 between neighbouring locations, from -max_move to max_move; a
+    negative number moves cars from i + 1 to i. With two locations this is the action of **RentalModel**.
+    :param rental_rates: expected requests per day at each location
+    :param return_rates: expected returns per day at each location
+    :param max_cars: cars a location can keep overnight, one number for all locations or one per location
+    :param chunk_size: states whose action values are computed together, bounds the memory of a backup
+    """
+
+    def __init__(self, rental_rates=(3, 3), return_rates=(4, 2), max_cars=20, max_move=5, rental_reward=10,
+                 move_cost=2, tail_tolerance=1e-9, chunk_size=4096):
+        if len(rental_rates) != len(return_rates):
+            raise ValueError("Need one return rate per location")
+        self.num_locations = len(rental_rates)
+        self.rental_rates = tuple(rental_rates)
+        self.return_rates = tuple(return_rates)
+        self.rental_reward = rental_reward
+        self.max_cars = np.broadcast_to(max_cars, (self.num_locations,)).astype(int)
+        self.shape = tuple(self.max_cars + 1)
+        self.num_states = int(np.prod(self.shape))
+        self._move_cost = move_cost
+        self._chunk_size = chunk_size
+
+        # Cars moved on each route, and the cars each location gives away and receives
+        self.moves = np.array(list(itertools.product(range(-max_move, max_move + 1),
+                                                     repeat=self.num_locations - 1)), dtype=int)
+        self.moves = self.moves.reshape(-1, self.num_locations - 1)
+        self.num_actions = len(self.moves)
+        forward = np.clip(self.moves, 0, None)
+        backward = np.clip(-self.moves, 0, None)
+        self._outflow = np.zeros((self.num_actions, self.num_locations), dtype=int)
+        self._outflow[:, :-1] += forward
+        self._outflow[:, 1:] += backward
+        self._net = -self._outflow
+        self._net[:, 1:] += forward
+        self._net[:, :-1] += backward
+        self._move_costs = move_cost * np.abs(self.moves).sum(axis=1)
+
+        # Cars in the morning can exceed max_cars after cars were moved in
+        self.morning_shape = tuple(self.max_cars + self._net.max(axis=0) + 1)
+        self.kernels = []
+        self._rentals = []
+        for location in range(self.num_locations):
+            kernel, rentals = self._location_kernel(rental_rates[location], return_rates[location],
+                                                    self.morning_shape[location] - 1, self.max_cars[location],
+                                                    rental_reward, tail_tolerance)
+            self.kernels.append(kernel)
+            self._rentals.append(rentals)
+        self._morning_transitions = None
+
+    @staticmethod
+    def _location_kernel(rental_rate, return_rate, max_morning, max_cars, rental_reward, tail_tolerance):
+        """
+        :return: (sparse (max_morning + 1, max_cars + 1) probabilities of the cars at the end of the day for every
+        number of cars in the morning, expected rental reward for every number of cars in the morning)
+        """
+        max_requests = int(poisson.isf(tail_tolerance, rental_rate))
+        max_returns = int(poisson.isf(tail_tolerance, return_rate))
+        morning = np.arange(max_morning + 1)[:, None]
+
+        # Rentals are the requests capped at the cars in the morning and at the truncation point
+        rent_caps = np.minimum(morning, max_requests)
+        rents = np.arange(min(max_morning, max_requests) + 1)
+        rent_probabilities = np.where(rents < rent_caps, poisson.pmf(rents, rental_rate),
+                                      np.where(rents == rent_caps, poisson.sf(rents - 1, rental_rate), 0.0))
+        returns = np.arange(max_returns + 1)
+        return_probabilities = poisson.pmf(returns, return_rate)
+        return_probabilities[-1] = poisson.sf(max_returns - 1, return_rate)
+
+        end_of_day = np.minimum(morning[:, :, None] - rents[None, :, None] + returns, max_cars)
+        probabilities = rent_probabilities[:, :, None] * return_probabilities
+        kept = probabilities > 0
+        rows = np.broadcast_to(morning[:, :, None], probabilities.shape)[kept]
+        kernel = sparse.csr_matrix((probabilities[kept], (rows, end_of_day[kept])),
+                                   shape=(max_morning + 1, max_cars + 1))
+        kernel.sum_duplicates()
+
+        # E[min(requests, morning)] is the sum of P(requests > k) for k < morning
+        rentals = rental_reward * np.concatenate([[0.0], np.cumsum(poisson.sf(np.arange(max_morning), rental_rate))])
+        return kernel, rentals
+
+    @property
+    def morning_transitions(self):
+        """
+        Sparse probabilities of the end of day states for every morning state, the Kronecker product of the location
+        kernels. Built on first use; only the linear solves need it, the backups use the kernels.
+        """
+        if self._morning_transitions is None:
+            transitions = self.kernels[0]
+            for kernel in self.kernels[1:]:
+                transitions = sparse.kron(transitions, kernel, format='csr')
+            self._morning_transitions = sparse.csr_matrix(transitions)
+        return self._morning_transitions
+
+    def state_index(self, cars):
+        """
+        :param cars: (..., num_locations) cars at each location
+        :return: the state indices
+        """
+        cars = np.asarray(cars)
+        return np.ravel_multi_index(tuple(np.moveaxis(cars, -1, 0)), self.shape)
+
+    def morning_cars(self, cars, actions):
+        """
+        :param cars: (..., num_locations) cars at each location
+        :return: the cars at each location after the actions moved them, and the cost of the moves
+        """
+        return cars + self._net[actions], self._move_costs[actions]
+
+    def state_cars(self, states):
+        """
+        :return: (len(states), num_locations) cars at each location of the states
+        """
+        return np.stack(np.unravel_index(states, self.shape), axis=-1)
+
+    def q_values(self, values, gamma, states=None):
+        states = np.arange(self.num_states) if states is None else np.asarray(states)
+        return self._q_values(values, gamma, states, self._expected_values(values, len(states) * self.num_actions))
+
+    def greedy(self, values, gamma, states=None):
+        """
+        Computes the action values of :chunk_size: states at a time.
+        """
+        states = np.arange(self.num_states) if states is None else np.asarray(states)
+        expected = self._expected_values(values, len(states) * self.num_actions)
+        best_values = np.empty(len(states))
+        actions = np.empty(len(states), dtype=int)
+        for start in range(0, len(states), self._chunk_size):
+            chunk = slice(start, start + self._chunk_size)
+            q_values = self._q_values(values, gamma, states[chunk], expected)
+            actions[chunk] = np.argmax(q_values, axis=1)
+            best_values[chunk] = q_values[np.arange(len(q_values)), actions[chunk]]
+        return best_values, actions
+
+    def policy_values(self, values, gamma, policy, states=None):
+        states = np.arange(self.num_states) if states is None else np.asarray(states)
+        expected = self._expected_values(values, len(states))
+        policy_values = np.empty(len(states))
+        for start in range(0, len(states), self._chunk_size):
+            chunk = states[start:start + self._chunk_size]
+            morning = self.state_cars(chunk) + self._net[policy[chunk]]
+            policy_values[start:start + len(chunk)] = self._rewards(morning, policy[chunk]) + \
+                gamma * self._expectation(values, morning, expected)
+        return policy_values
+
+    def policy_transitions(self, policy, states):
+        states = np.asarray(states)
+        morning = self.state_cars(states) + self._net[policy[states]]
+        morning_states = np.ravel_multi_index(tuple(morning.T), self.morning_shape)
+        return self.morning_transitions[morning_states], self._rewards(morning, policy[states])
+
+    def _q_values(self, values, gamma, states, expected):
+        cars = self.state_cars(states)
+        valid = (cars[:, None, :] >= self._outflow).all(axis=2)
+        morning = cars[:, None, :] + self._net
+        state_rows, actions = np.nonzero(valid)
+        morning = morning[state_rows, actions]
+
+        q_values = np.full(valid.shape, -np.inf)
+        q_values[state_rows, actions] = self._rewards(morning, actions) + \
+            gamma * self._expectation(values, morning, expected)
+        return q_values
+
+    def _rewards(self, morning, actions):
+        rewards = -self._move_costs[actions].astype(float)
+        for location, rentals in enumerate(self._rentals):
+            rewards += rentals[morning[:, location]]
+        return rewards
+
+    def _expected_values(self, values, num_backups):
+        """
+        :return: the grid of the expected next value of every morning state, or None if the :num_backups: backups are
+        those of a single state, which only need their kernel rows
+        """
+        if num_backups <= self.num_actions:
+            return None
+        return separable_expectation(self.kernels, values.reshape(self.shape))
+
+    def _expectation(self, values, morning, expected):
+        if expected is not None:
+            return expected[tuple(morning.T)]
+        return separable_expectation_at(self.kernels, values.reshape(self.shape), morning)
+
+
+if __name__ == '__main__':
+    from chap_4.dp_solver import DPSolver
+
+    fleet = FleetRentalModel(rental_rates=(3, 4), return_rates=(3, 2), max_cars=50)
+    result = DPSolver(fleet, gamma=0.9, threshold=1e-4, evaluation='direct') \
+        .policy_iteration(np.zeros(fleet.num_states), np.full(fleet.num_states, fleet.num_actions // 2))
+    print("Policy stable after {} improvements".format(result.improvements))
+    print(fleet.moves[result.policy].reshape(fleet.shape))
@@ -19,27 +19,31 @@ from chap_4.jacks_car_rental.rental_policy import RentalPolicy
 
 
 class RentalLocation:
-    def __init__(self, request_rate, return_rate, max_cars=20):
+    """
+    One day at one location. The number of cars can be one number or an array, e.g. one per simulated episode; the
+    draws are then made for all of them at once.
+    :param random: np.random or a numpy Generator to draw from
+    """
+
+    def __init__(self, request_rate, return_rate, max_cars=20, rental_reward=10, random=np.random):
         self._request_rate = request_rate
         self._return_rate = return_rate
         self._max_cars = max_cars
+        self._rental_reward = rental_reward
+        self._random = random
 
     def rent_cars(self, avail_cars):
         """
-        Draws number of rental cars from the poisson distribution. If there is no sufficient number of cars, deduct the rewards.
+        Draws number of rental cars from the poisson distribution. If there is no sufficient number of cars, only the
+        available cars are rented.
+        :return: (cars left, rewards)
         """
-        num_rents = np.random.poisson(self._request_rate)
-        if avail_cars >= num_rents:
-            reward = num_rents * 10
-            left_cars = avail_cars - num_rents
-        else:
-            reward = avail_cars * 10
-            left_cars = 0
-        return left_cars, reward
+        num_rents = np.minimum(self._random.poisson(self._request_rate, np.shape(avail_cars)), avail_cars)
+        return avail_cars - num_rents, num_rents * self._rental_reward
 
     def return_cars(self, avail_cars):
-        num_returns = np.random.poisson(self._request_rate)
-        return min(self._max_cars, avail_cars + num_returns)
+        num_returns = self._random.poisson(self._return_rate, np.shape(avail_cars))
+        return np.minimum(self._max_cars, avail_cars + num_returns)
 
 
 if __name__ == '__main__':
@@ -1,88 +1,68 @@
-from scipy.stats import poisson
+from chap_4.dp_checkpoint import load_checkpoint
+from chap_4.dp_solver import DPSolver
+from chap_4.jacks_car_rental.rental_model import RentalModel
 
 
 class PolicyIteration:
-    def __init__(self, policy, gamma=0.9):
+    """
+    Policy iteration over the precomputed **RentalModel**, solved by **DPSolver**. Extra keyword arguments go to the
+    model, e.g. the rental and return rates.
+    :param sweep: 'jacobi' or 'gauss_seidel', see **DPSolver**
+    :param evaluation: 'sweeps', or 'direct' / 'iterative' to evaluate every policy exactly with a linear solve
+    :param trace: **SolverTrace** that records the convergence, if given
+    :param checkpoint: path the solver saves its progress to, see **DPSolver**
+    :param workers: processes that improve the policy in parallel, see **DPSolver**; call **close** to stop them
+    """
+
+    def __init__(self, policy, gamma=0.9, threshold=0.005, sweep='jacobi', evaluation='sweeps', trace=None,
+                 checkpoint=None, workers=1, **model_kwargs):
         self._policy = policy
         self._gamma = gamma
-        self._car_rental = {
-            'rental': [poisson(3), poisson(3)],
-            'return': [poisson(4), poisson(2)]
-        }
+        self._model = RentalModel(policy.get_state_actions(), **model_kwargs)
+        self._solver = DPSolver(self._model, gamma, threshold, sweep, evaluation, trace=trace, checkpoint=checkpoint,
+                                workers=workers)
 
-    def evaluate(self):
+    def warm_start(self, checkpoint):
         """
-        Evaluates the policy, then improve it by updating the policy with best action
+        Starts from the values and policy of a checkpoint, e.g. the solution for nearby rental rates.
         """
-        while True:
-            delta = 0
-            for state, value in self._policy.get_state_values().items():
-                action = self._policy.take_action(state)
-                new_value = self._estimate_value(state, action)
-                self._policy.update_state_value(state, new_value)
-                delta = max(delta, abs(value - new_value))
-                print("Updating value for state {} from {} to {} with delta {}".format(state, value, new_value, delta))
+        saved = load_checkpoint(checkpoint)
+        if len(saved.values) != self._model.num_states:
+            raise ValueError("Checkpoint has {} states, the model {}".format(len(saved.values), self._model.num_states))
+        self._update_policy(saved.values, saved.policy)
 
-            if delta < 0.005:
-                break
+    def resume(self):
+        """
+        Continues the policy iteration saved in the checkpoint and updates the policy with its result.
+        """
+        result = self._solver.resume()
+        self._update_policy(result.values, result.policy)
 
-        print("policy state values: {}".format(self._policy.get_state_values()))
-        self.improvement()
+    def evaluate(self):
+        """
+        Evaluates the policy, then improve it by updating the policy with best action, until the policy is stable
+        """
+        model = self._model
+        result = self._solver.policy_iteration(model.to_array(self._policy.get_state_values()),
+                                               model.to_action_indices(self._policy.get_policy()))
+        self._update_policy(result.values, result.policy)
 
     def improvement(self):
         """
-        Improves the policy by finding and update the best action for each state. If the policy is not stable,
-        evaluate it again.
+        Improves the policy by finding and update the best action for each state.
+        :return: True if the policy is stable
         """
-        policy_stable = True
-        for state, value in self._policy.get_state_values().items():
-            old_action = self._policy.take_action(state)
-            best_action = self._find_best_action(state)
-            self._policy.update_action(state, best_action)
-            if old_action != best_action:
-                policy_stable = False
-
-        print("new policy: {}".format(self._policy.get_policy()))
-
-        if policy_stable:
-            return
-        else:
-            self.evaluate()
-
-    def _estimate_value(self, state, action):
-        total_reward = 0
-        # number of cars start of the day
-        new_state, reward = self._move_cars(state, action)
-        total_reward += reward
-
-        for num_rent_1 in range(0, new_state[0] + 1):
-            for num_rent_2 in range(0, new_state[1] + 1):
-                reward = (num_rent_1 + num_rent_2) * 10
-                for num_return_1 in range(0, 11):  # only consider returning less than 11 cars to reduce the computation load
-                    for num_return_2 in range(0, 11):
-                        # Number of cars by end of day
-                        car_1 = min(new_state[0] - num_rent_1 + num_return_1, 20)
-                        car_2 = min(new_state[1] - num_rent_2 + num_return_2, 20)
-                        prob = self._car_rental['rental'][0].pmf(num_rent_1) * \
-                               self._car_rental['rental'][1].pmf(num_rent_2) * \
-                               self._car_rental['return'][0].pmf(car_1 - (new_state[0] - num_rent_1)) * \
-                               self._car_rental['return'][1].pmf(car_2 - (new_state[1] - num_rent_2))
-
-                        total_reward += prob * (reward + self._gamma * self._policy.get_state_values()[(car_1, car_2)])
-
-        return total_reward
-
-    @staticmethod
-    def _move_cars(state, action):
-        new_state = (state[0] - action, state[1] + action)
-        reward = abs(action) * (-2)
-        return new_state, reward
+        model = self._model
+        values = model.to_array(self._policy.get_state_values())
+        old_policy = model.to_action_indices(self._policy.get_policy())
+        new_policy = self._solver.improve_policy(values)
+        self._update_policy(values, new_policy)
+        return bool((old_policy == new_policy).all())
 
-    def _find_best_action(self, state):
-        action_values = {action: self._estimate_value(state, action) for action in
-                         self._policy.get_state_actions()[state]}
-        # print("estimated action value: {}".format(list(action_values)))
-        best_action = max(action_values, key=action_values.get)
-        # print("best action {} with value {} for state {}".format(best_action, action_values[best_action], state))
+    def _update_policy(self, values, policy):
+        for state, value, action in zip(self._model.states, values, self._model.actions[policy]):
+            self._policy.update_state_value(state, value)
+            self._policy.update_action(state, int(action))
 
-        return best_action
+    def close(self):
+        self._solver.close()
@@ -0,0 +1,168 @@
+import numpy as np
+from scipy import sparse
+from scipy.stats import poisson
+
+from chap_4.dp_solver import TabularModel
+
+
+def separable_expectation(kernels, values):
+    """
+    Expected next values when the locations move independently: the kernel of each location applied along its axis of
+    the value grid, e.g. K1 V K2^T for two locations. Costs one small matrix product per location instead of summing
+    over the joint outcomes.
+    :param kernels: (morning cars, end of day cars) transition matrix of each location, dense or sparse
+    :param values: value grid with one axis of end of day cars per location
+    :return: grid of the expected next value with one axis of morning cars per location
+    """
+    expected = values
+    for axis, kernel in enumerate(kernels):
+        moved = np.moveaxis(expected, axis, 0)
+        contracted = np.asarray(kernel @ moved.reshape(moved.shape[0], -1))
+        expected = np.moveaxis(contracted.reshape((kernel.shape[0],) + moved.shape[1:]), 0, axis)
+    return expected
+
+
+def separable_expectation_at(kernels, values, morning):
+    """
+    Same as **separable_expectation** for a few morning states, using only their kernel rows.
+    :param morning: (n, locations) morning cars
+    :return: the n expected next values
+    """
+    rows = [kernel[morning[:, location]] for location, kernel in enumerate(kernels)]
+    rows = [location_rows.toarray() if sparse.issparse(location_rows) else location_rows for location_rows in rows]
+    expected = rows[0] @ values.reshape(values.shape[0], -1)
+    for location_rows in rows[1:]:
+        expected = (expected.reshape(len(morning), location_rows.shape[1], -1) * location_rows[:, :, None]).sum(axis=1)
+    return expected.ravel()
+
+
+class RentalModel(TabularModel):
+    """
+    Expected rewards R[s, a] and transition probabilities of Jack's car rental, computed once from the Poisson rates.
+    The outcomes of both locations are independent, so backups take the expected next values with one kernel per
+    location (see **separable_expectation**) for all states and actions at once; the dense P[s, a, s'] is only built
+    for the linear solves and prioritized sweeping. Uses the same approximations as the original per state estimate:
+    at most the available cars are rented, at most :max_returns: cars are returned, and the cars above :max_cars: at
+    the end of the day are dropped. Each number of returns is weighted by its own probability, also when the cars are
+    capped at :max_cars:.
+
+    States are indexed in the order of :state_actions: and actions from -max_move to max_move.
+    :param state_actions: dict of the eligible actions of each state, see **StatesActions.get_state_actions**
+    :param max_cars: the largest number of cars of the states if None
+    """
+
+    def __init__(self, state_actions, rental_rates=(3, 3), return_rates=(4, 2), max_cars=None, max_returns=10,
+                 rental_reward=10, move_cost=2):
+        self.states = list(state_actions)
+        if max_cars is None:
+            max_cars = max(max(state) for state in self.states)
+        max_move = max(max(abs(action) for action in actions) for actions in state_actions.values())
+        self.actions = np.arange(-max_move, max_move + 1)
+        self._max_cars = max_cars
+        self._state_index = {state: index for index, state in enumerate(self.states)}
+        self._cells = tuple(np.array(self.states).T)
+        self.num_states = len(self.states)
+        self.num_actions = len(self.actions)
+
+        # Valid actions of each state
+        self.valid = np.zeros((len(self.states), len(self.actions)), dtype=bool)
+        for index, state in enumerate(self.states):
+            self.valid[index, np.asarray(state_actions[state]) + max_move] = True
+
+        # Cars at each location in the morning, after moving; can be more than max_cars
+        cars = np.array(self.states)
+        morning_1 = np.clip(cars[:, 0:1] - self.actions, 0, None)
+        morning_2 = np.clip(cars[:, 1:2] + self.actions, 0, None)
+        max_morning = max(morning_1.max(), morning_2.max())
+
+        transitions_1, rentals_1, masses_1 = self._location_kernel(rental_rates[0], return_rates[0], max_morning,
+                                                                   max_returns, rental_reward)
+        transitions_2, rentals_2, masses_2 = self._location_kernel(rental_rates[1], return_rates[1], max_morning,
+                                                                   max_returns, rental_reward)
+
+        # The outcomes of both locations are independent, so the joint probabilities and rewards factorize
+        self.rewards = -move_cost * np.abs(self.actions) + rentals_1[morning_1] * masses_2[morning_2] + \
+            masses_1[morning_1] * rentals_2[morning_2]
+        self.rewards[~self.valid] = 0.0
+        self.kernels = [transitions_1, transitions_2]
+        self._morning = np.stack([morning_1, morning_2], axis=-1)
+        self._transitions = None
+
+    @property
+    def transitions(self):
+        """
+        Dense P[s, a, s'], built on first use.
+        """
+        if self._transitions is None:
+            transitions_1, transitions_2 = self.kernels
+            self._transitions = np.einsum('sai,saj->saij', transitions_1[self._morning[..., 0]],
+                                          transitions_2[self._morning[..., 1]]) \
+                .reshape(len(self.states), len(self.actions), -1)
+            self._transitions[~self.valid] = 0.0
+        return self._transitions
+
+    def _location_kernel(self, rental_rate, return_rate, max_morning, max_returns, rental_reward):
+        """
+        :return: for every number of cars in the morning: the (not normalized) probability of each number of cars at
+        the end of the day, the expected rental reward and the total probability
+        """
+        morning = np.arange(0, max_morning + 1)[:, None, None]
+        rents = np.arange(0, max_morning + 1)[None, :, None]
+        returns = np.arange(0, max_returns + 1)[None, None, :]
+
+        left = morning - rents
+        end_of_day = np.clip(left + returns, 0, self._max_cars)
+        probability = np.where(left >= 0, poisson.pmf(rents, rental_rate) * poisson.pmf(returns, return_rate), 0.0)
+
+        transitions = np.zeros((max_morning + 1, self._max_cars + 1))
+        np.add.at(transitions, (np.broadcast_to(morning, probability.shape), end_of_day), probability)
+        rentals = (probability * rents * rental_reward).sum(axis=(1, 2))
+        masses = probability.sum(axis=(1, 2))
+        return transitions, rentals, masses
+
+    def q_values(self, values, gamma, states=None):
+        if states is None:
+            states = slice(None)
+        q_values = self.rewards[states] + gamma * self._expected_values(values, self._morning[states])
+        q_values[~self.valid[states]] = -np.inf
+        return q_values
+
+    def policy_values(self, values, gamma, policy, states=None):
+        if states is None:
+            states = np.arange(self.num_states)
+        actions = policy[states]
+        return self.rewards[states, actions] + gamma * self._expected_values(values, self._morning[states, actions])
+
+    def _expected_values(self, values, morning):
+        """
+        :param morning: (..., 2) morning cars at both locations
+        :return: the expected next values of the morning states
+        """
+        grid = np.zeros((self._max_cars + 1, self._max_cars + 1))
+        grid[self._cells] = values
+        if morning.size // 2 <= len(self.actions):
+            # A single state, as in Gauss-Seidel sweeps, only needs its kernel rows
+            return separable_expectation_at(self.kernels, grid, morning.reshape(-1, 2)).reshape(morning.shape[:-1])
+        expected = separable_expectation(self.kernels, grid)
+        return expected[morning[..., 0], morning[..., 1]]
+
+    def policy_transitions(self, policy, states):
+        actions = policy[states]
+        return sparse.csr_matrix(self.transitions[states, actions]), self.rewards[states, actions]
+
+    def predecessors(self):
+        probabilities = self.transitions.max(axis=1)
+        return [(np.flatnonzero(probabilities[:, state]), probabilities[:, state][probabilities[:, state] > 0])
+                for state in range(self.num_states)]
+
+    def to_array(self, state_dict):
+        """
+        :return: the dict keyed by state as an array indexed like **states**
+        """
+        return np.array([state_dict[state] for state in self.states], dtype=float)
+
+    def to_action_indices(self, policy):
+        return np.array([policy[state] for state in self.states]) - self.actions[0]
+
+    def state_index(self, state):
+        return self._state_index[state]
@@ -3,8 +3,9 @@ import numpy as np
 
 class RentalPolicy:
 
-    def __init__(self):
-        self._states_actions = StatesActions(max_cars=20)
+    def __init__(self, max_cars=20, max_move=5):
+        self._max_cars = max_cars
+        self._states_actions = StatesActions(max_cars=max_cars, max_move=max_move)
         # print("all states {}".format(self._states_actions.get_states()))
         self._state_values = {state: np.random.normal(0, 1) for state in self._states_actions.get_states()}
         # print("state values {}".format(self._state_values))
@@ -32,16 +33,16 @@ class RentalPolicy:
     def get_policy(self):
         return self._policy
 
-    @staticmethod
-    def _assert_state(state):
+    def _assert_state(self, state):
         assert len(state) == 2
-        assert 0 <= state[0] <= 20
-        assert 0 <= state[1] <= 20
+        assert 0 <= state[0] <= self._max_cars
+        assert 0 <= state[1] <= self._max_cars
 
 
 class StatesActions:
-    def __init__(self, max_cars=20):
+    def __init__(self, max_cars=20, max_move=5):
         self._max_cars = max_cars
+        self._max_move = max_move
         self._states_actions = self.generate_states(self._max_cars)
 
     def generate_states(self, max_cars):
@@ -54,7 +55,7 @@ class StatesActions:
 
     def generate_actions(self, avail_car_tuple):
         # Example: (5, 4) -> [-4, -3, -2, ... 4, 5]
-        return range(-min(avail_car_tuple[1], 5), min(avail_car_tuple[0], 5) + 1)
+        return range(-min(avail_car_tuple[1], self._max_move), min(avail_car_tuple[0], self._max_move) + 1)
 
     def get_state_actions(self):
         return self._states_actions
@@ -0,0 +1,92 @@
+"""Monte Carlo check of the policies and values of **FleetRentalModel**. Rolls a policy out for many episodes from a
+set of start states, every day drawing the requests and returns of all episodes at once, and compares the discounted
+returns with the values computed by dynamic programming."""
+
+import math
+from collections import namedtuple
+from statistics import NormalDist
+
+import numpy as np
+
+from chap_4.jacks_car_rental.jacks_car_rental import RentalLocation
+
+# Per start state: mean discounted return, its standard deviation and the confidence interval of the mean.
+# truncation_bound: the most the returns after the last simulated day could add
+SimulationResult = namedtuple('SimulationResult', ['start_states', 'mean', 'std', 'lower', 'upper', 'episodes', 'days',
+                                                   'truncation_bound'])
+
+
+class RentalSimulator:
+    """
+    Simulates the dynamics of a **FleetRentalModel** without its truncation of the Poisson tails.
+    :param seed: seed of the numpy Generator the draws come from
+    :param batch_size: episodes simulated together, bounds the memory
+    """
+
+    def __init__(self, model, seed=None, batch_size=1 << 16):
+        self._model = model
+        self._random = np.random.default_rng(seed)
+        self._batch_size = batch_size
+        self._locations = [RentalLocation(rental_rate, return_rate, max_cars, model.rental_reward, self._random)
+                           for rental_rate, return_rate, max_cars in
+                           zip(model.rental_rates, model.return_rates, model.max_cars)]
+
+    def rollout(self, policy, start_states, episodes=10000, gamma=0.9, days=None, confidence=0.95):
+        """
+        :param policy: action index of every state
+        :param start_states: state indices to start the episodes from
+        :param days: days per episode; by default enough for gamma^days to drop below 1e-4
+        :return: **SimulationResult**
+        """
+        start_states = np.asarray(start_states)
+        if days is None:
+            days = math.ceil(math.log(1e-4) / math.log(gamma))
+        sums = np.zeros(len(start_states))
+        squares = np.zeros(len(start_states))
+
+        # Episodes of all start states, flattened and simulated in batches
+        total = len(start_states) * episodes
+        for start in range(0, total, self._batch_size):
+            starts = np.arange(start, min(start + self._batch_size, total)) // episodes
+            returns = self._discounted_returns(policy, start_states[starts], gamma, days)
+            sums += np.bincount(starts, weights=returns, minlength=len(start_states))
+            squares += np.bincount(starts, weights=returns ** 2, minlength=len(start_states))
+
+        mean = sums / episodes
+        std = np.sqrt(np.maximum(squares / episodes - mean ** 2, 0.0) * episodes / max(episodes - 1, 1))
+        half_width = NormalDist().inv_cdf((1 + confidence) / 2) * std / math.sqrt(episodes)
+        max_reward = self._model.rental_reward * self._model.max_cars.sum()
+        return SimulationResult(start_states, mean, std, mean - half_width, mean + half_width, episodes, days,
+                                gamma ** days * max_reward / (1 - gamma))
+
+    def compare(self, values, result):
+        """
+        :param values: value of every state from dynamic programming
+        :param result: **SimulationResult** of the policy of the values
+        :return: dict with the values of the start states, the differences to the simulated means, their z scores and
+        whether each value lies in the confidence interval widened by the truncation bound
+        """
+        expected = np.asarray(values)[result.start_states]
+        difference = result.mean - expected
+        standard_error = result.std / math.sqrt(result.episodes)
+        return {
+            'values': expected,
+            'difference': difference,
+            'z': np.divide(difference, standard_error, out=np.zeros_like(difference), where=standard_error > 0),
+            'consistent': (expected >= result.lower) & (expected <= result.upper + result.truncation_bound)
+        }
+
+    def _discounted_returns(self, policy, states, gamma, days):
+        cars = self._model.state_cars(states)
+        returns = np.zeros(len(states))
+        discount = 1.0
+        for day in range(days):
+            cars, move_costs = self._model.morning_cars(cars, policy[self._model.state_index(cars)])
+            rewards = -move_costs.astype(float)
+            for index, location in enumerate(self._locations):
+                left, location_rewards = location.rent_cars(cars[:, index])
+                cars[:, index] = location.return_cars(left)
+                rewards += location_rewards
+            returns += discount * rewards
+            discount *= gamma
+        return returns
@@ -1,7 +1,8 @@
 from abc import abstractmethod
 
 import numpy as np
-import random
+
+from framework.sampling import BlockSampler
 
 
 class ActionSelector:
@@ -17,27 +18,165 @@ class ActionSelector:
     def select_action(self):
         pass
 
+    def select_actions(self, n):
+        """
+        Selects :n: actions at once for the current estimates, e.g. for requests whose rewards arrive later. The
+        actions follow the distribution of :n: calls to **select_action** with no rewards added in between.
+        :return: array of the actions
+        """
+        return np.array([self.select_action() for _ in range(n)], dtype=int)
+
 
 class GreedyActionSelector(ActionSelector):
     """
     Selects an action based mainly based on the greedy method. Randomness can be controlled by epsilon.
+    Ties between greedy actions are broken randomly. The random numbers are drawn in blocks of :block_size:.
     :param epsilon: decides the probability of taking a random action
     """
 
-    def __init__(self, action_value_estimator, epsilon):
+    def __init__(self, action_value_estimator, epsilon, block_size=4096):
         super().__init__(action_value_estimator)
         self._epsilon = epsilon
+        num_actions = len(action_value_estimator.get_estimated_q_a())
+        self._uniform = BlockSampler('random_sample', block_size=block_size)
+        self._random_actions = BlockSampler('randint', 0, num_actions, block_size=block_size)
 
     def select_action(self):
         """
         Selects an action based mainly based on the greedy method. Randomness can be controlled by epsilon.
         :return: the selected action
         """
+        if self._epsilon > 0 and self._uniform.next() < self._epsilon:
+            return self._random_actions.next()
+
+        greedy_actions = self._action_value_estimator.get_greedy_actions()
+        if len(greedy_actions) == 1:
+            return greedy_actions[0]
+        return greedy_actions[int(self._uniform.next() * len(greedy_actions))]
+
+    def select_actions(self, n):
+        greedy_actions = self._action_value_estimator.get_greedy_actions()
+        if len(greedy_actions) == 1:
+            actions = np.full(n, greedy_actions[0])
+        else:
+            actions = np.asarray(greedy_actions)[(self._uniform.take(n) * len(greedy_actions)).astype(int)]
+        if self._epsilon > 0:
+            explore = self._uniform.take(n) < self._epsilon
+            actions[explore] = self._random_actions.take(np.count_nonzero(explore))
+        return actions
+
+
+class UCBActionSelector(ActionSelector):
+    """
+    Upper-Confidence-Bound action selection: takes the action maximizing q(a) + c * sqrt(ln(t) / N(a)). Actions that
+    have not been taken yet are taken first, in random order.
+    :param c: controls the degree of exploration
+    """
+
+    def __init__(self, action_value_estimator, c, block_size=4096):
+        super().__init__(action_value_estimator)
+        self._c = c
+        self._uniform = BlockSampler('random_sample', block_size=block_size)
+
+    def select_action(self):
+        estimator = self._action_value_estimator
+        action_counts = estimator.get_action_counts()
+        steps = estimator.get_steps()
+        if steps < len(action_counts):
+            untried_actions = np.flatnonzero(action_counts == 0)
+            if len(untried_actions) > 0:
+                return int(untried_actions[int(self._uniform.next() * len(untried_actions))])
+
+        upper_bounds = estimator.get_estimated_q_a() + self._c * np.sqrt(np.log(steps) / action_counts)
+        return int(np.argmax(upper_bounds))
+
+
+class SoftmaxActionSelector(ActionSelector):
+    """
+    Takes each action with probability proportional to exp(q(a) / temperature). Used with **GradientBanditEstimator**,
+    it is the gradient bandit algorithm.
+    """
+
+    def __init__(self, action_value_estimator, temperature=1.0, block_size=4096):
+        super().__init__(action_value_estimator)
+        self._temperature = temperature
+        self._uniform = BlockSampler('random_sample', block_size=block_size)
+
+    def select_action(self):
+        estimated_q_a = self._action_value_estimator.get_estimated_q_a()
+        weights = np.cumsum(np.exp((estimated_q_a - estimated_q_a.max()) / self._temperature))
+        return int(np.searchsorted(weights, self._uniform.next() * weights[-1], side='right'))
+
+    def select_actions(self, n):
         estimated_q_a = self._action_value_estimator.get_estimated_q_a()
+        weights = np.cumsum(np.exp((estimated_q_a - estimated_q_a.max()) / self._temperature))
+        return np.searchsorted(weights, self._uniform.take(n) * weights[-1], side='right')
 
-        if np.random.rand() < self._epsilon:
-            chosen_action = random.choice(list(estimated_q_a.keys()))
+
+class CompactGreedyActionSelector(ActionSelector):
+    """
+    **GreedyActionSelector** for a **CompactActionValueEstimator**. Neither the greedy action nor a random action
+    touches the other actions, so a step costs O(log num_actions).
+    :param epsilon: decides the probability of taking a random action
+    """
+
+    def __init__(self, action_value_estimator, epsilon, block_size=4096):
+        super().__init__(action_value_estimator)
+        self._epsilon = epsilon
+        num_actions = len(action_value_estimator.get_estimated_q_a())
+        self._uniform = BlockSampler('random_sample', block_size=block_size)
+        self._random_actions = BlockSampler('randint', 0, num_actions, block_size=block_size)
+
+    def select_action(self):
+        if self._epsilon > 0 and self._uniform.next() < self._epsilon:
+            return self._random_actions.next()
+        return self._action_value_estimator.get_greedy_action(self._uniform.next())
+
+    def select_actions(self, n):
+        """
+        Draws which of the :n: selections explore at once. The greedy selections share one greedy action unless
+        several actions tie; only then is the tree walked once per greedy selection, to break the ties.
+        """
+        estimator = self._action_value_estimator
+        actions = np.empty(n, dtype=int)
+        explore = self._uniform.take(n) < self._epsilon if self._epsilon > 0 else np.zeros(n, dtype=bool)
+        actions[explore] = self._random_actions.take(np.count_nonzero(explore))
+        greedy = ~explore
+        if estimator.count_greedy_actions() == 1:
+            actions[greedy] = estimator.get_greedy_action()
         else:
-            chosen_action = max(estimated_q_a, key=estimated_q_a.get)
+            actions[greedy] = [estimator.get_greedy_action(uniform)
+                               for uniform in self._uniform.take(np.count_nonzero(greedy)).tolist()]
+        return actions
+
+
+class BatchGreedyActionSelector:
+    """
+    Batched version of **GreedyActionSelector**. Selects one action for every epoch of a batched estimator. Ties between
+    greedy actions are broken randomly, with random numbers drawn only for the epochs that have ties.
+    :param epsilon: decides the probability of taking a random action
+    """
+
+    def __init__(self, action_value_estimator, epsilon):
+        self._action_value_estimator = action_value_estimator
+        self._epsilon = epsilon
+
+    def select_action(self):
+        """
+        :return: the selected action of each epoch
+        """
+        estimated_q_a = self._action_value_estimator.get_estimated_q_a()
+        epochs, num_actions = estimated_q_a.shape
+
+        chosen_actions = np.argmax(estimated_q_a, axis=1)
+        greedy = estimated_q_a == estimated_q_a[np.arange(epochs), chosen_actions][:, None]
+        tied = np.flatnonzero(np.count_nonzero(greedy, axis=1) > 1)
+        if len(tied):
+            # The greedy action with the largest random key is uniform among the tied ones
+            keys = np.where(greedy[tied], np.random.rand(len(tied), num_actions), -1.0)
+            chosen_actions[tied] = np.argmax(keys, axis=1)
+        if self._epsilon > 0:
+            explore = np.random.rand(epochs) < self._epsilon
+            chosen_actions[explore] = np.random.randint(num_actions, size=np.count_nonzero(explore))
 
-        return chosen_action
+        return chosen_actions
@@ -1,28 +1,166 @@
 from abc import abstractmethod
+from array import array
 
 import numpy as np
 
+from framework.max_tree import MaxTree
+
 
 class ActionValueEstimator:
     """
-    Estimates the action value
+    Estimates the action value. The estimates are kept in an array, along with a running total of the rewards and the
+    set of greedy actions, so that every query costs O(1). Updating one estimate costs O(1) too, unless the last greedy
+    action loses its lead: then all actions are scanned for the new maximum in O(num_actions), as **add_rewards** does
+    whenever a greedy action drops. This is the common case, not a rare one: with epsilon-greedy selection and noisy
+    rewards the greedy action drops on about 45% of the steps (see rescans/step of **bench_large_actions**), so an
+    update costs O(num_actions) amortized. The scan is one vectorized numpy pass, cheaper than a Python **MaxTree**
+    walk up to tens of thousands of actions; beyond that, see **CompactActionValueEstimator**, whose updates cost
+    O(log num_actions).
     """
 
+    def __init__(self, num_actions):
+        self._num_actions = num_actions
+        self._q_a = np.zeros(num_actions)
+        self._q_a_view = self._q_a.view()
+        self._q_a_view.flags.writeable = False
+        self._occurrences = np.zeros(num_actions, dtype=np.int64)
+        self._occurrences_view = self._occurrences.view()
+        self._occurrences_view.flags.writeable = False
+        self._total_reward = 0.0
+        self._counter = 0
+        # All actions whose q(a) equals the maximum, and the position of each action in that list (-1 if not greedy)
+        self._max_q_a = 0.0
+        self._greedy_actions = list(range(num_actions))
+        self._greedy_positions = np.arange(num_actions)
+
     @abstractmethod
     def add_reward(self, action, reward):
         pass
 
+    def add_rewards(self, actions, rewards):
+        """
+        Adds the rewards of several actions at once, e.g. feedback that arrived late and in bulk. The rewards count in
+        the order given; the estimates are those of calling **add_reward** for every pair, up to rounding.
+        """
+        if len(actions) == 0:
+            return
+        distinct, sorted_rewards, group, counts = _group_rewards(actions, rewards)
+        old_values = self._q_a[distinct]
+        self._q_a[distinct] = self._batch_values(distinct, old_values, sorted_rewards, group, counts)
+        self._record_batch(distinct, counts, sorted_rewards, old_values)
+
     @abstractmethod
-    def get_estimated_q_a(self):
+    def _batch_values(self, actions, old_values, sorted_rewards, group, counts):
+        """
+        :param actions: distinct actions of the batch, sorted
+        :param sorted_rewards: rewards of the batch sorted by action, in their order within each action
+        :param group: index into :actions: of every sorted reward
+        :param counts: number of rewards of every action
+        :return: the new estimates of :actions:
+        """
         pass
 
-    @abstractmethod
+    def get_estimated_q_a(self):
+        """
+        :return: read-only view of the estimated q(a), indexed by action
+        """
+        return self._q_a_view
+
+    def get_action_counts(self):
+        """
+        :return: read-only view of the number of times each action has been taken
+        """
+        return self._occurrences_view
+
+    def get_greedy_actions(self):
+        """
+        :return: the actions with the highest estimated q(a), in no particular order. Must not be modified.
+        """
+        return self._greedy_actions
+
     def get_avg_reward(self):
-        pass
+        """
+        :return: estimated average rewards based on all the actions have been taken so far
+        """
+        return self._total_reward / self._counter
+
+    def get_steps(self):
+        """
+        :return: number of rewards added so far
+        """
+        return self._counter
 
-    @abstractmethod
     def reset(self):
-        pass
+        """
+        Removes all estimated rewards
+        """
+        self._q_a.fill(0.0)
+        self._occurrences.fill(0)
+        self._total_reward = 0.0
+        self._counter = 0
+        self._max_q_a = 0.0
+        self._greedy_actions = list(range(self._num_actions))
+        self._greedy_positions = np.arange(self._num_actions)
+
+    def _record(self, action, reward, old_value):
+        """
+        Updates the running total and the greedy actions after q(action) changed from old_value.
+        """
+        self._total_reward += reward
+        self._counter += 1
+        self._occurrences[action] += 1
+
+        value = self._q_a[action]
+        if value > self._max_q_a:
+            self._greedy_positions[self._greedy_actions] = -1
+            self._max_q_a = float(value)
+            self._greedy_actions = [action]
+            self._greedy_positions[action] = 0
+        elif value == self._max_q_a:
+            if old_value != self._max_q_a:
+                self._greedy_positions[action] = len(self._greedy_actions)
+                self._greedy_actions.append(action)
+        elif old_value == self._max_q_a:
+            self._remove_greedy_action(action)
+            if not self._greedy_actions:
+                self._find_greedy_actions()
+
+    def _record_batch(self, actions, counts, rewards, old_values):
+        """
+        **_record** for a batch of distinct actions. Only scans all actions if a greedy action lost its lead.
+        """
+        self._total_reward += float(rewards.sum())
+        self._counter += len(rewards)
+        self._occurrences[actions] += counts
+
+        values = self._q_a[actions]
+        if ((old_values == self._max_q_a) & (values < self._max_q_a)).any():
+            self._find_greedy_actions()
+            return
+        best_value = values.max()
+        if best_value > self._max_q_a:
+            self._greedy_positions[self._greedy_actions] = -1
+            self._max_q_a = float(best_value)
+            self._greedy_actions = []
+        added = actions[(values == self._max_q_a) & (old_values != self._max_q_a)]
+        self._greedy_positions[added] = np.arange(len(self._greedy_actions), len(self._greedy_actions) + len(added))
+        self._greedy_actions.extend(added.tolist())
+
+    def _remove_greedy_action(self, action):
+        # Swap with the last greedy action, so that removal is O(1)
+        position = self._greedy_positions[action]
+        last_action = self._greedy_actions.pop()
+        if last_action != action:
+            self._greedy_actions[position] = last_action
+            self._greedy_positions[last_action] = position
+        self._greedy_positions[action] = -1
+
+    def _find_greedy_actions(self):
+        self._max_q_a = float(self._q_a.max())
+        greedy_actions = np.flatnonzero(self._q_a == self._max_q_a)
+        self._greedy_positions.fill(-1)
+        self._greedy_positions[greedy_actions] = np.arange(len(greedy_actions))
+        self._greedy_actions = greedy_actions.tolist()
 
 
 class AverageRewardsEstimator(ActionValueEstimator):
@@ -31,112 +169,363 @@ class AverageRewardsEstimator(ActionValueEstimator):
     """
 
     def __init__(self, num_actions):
-        self._num_actions = num_actions
-        self._action_occurrence_total_rewards = {}
-        for action in range(0, num_actions):
-            self._action_occurrence_total_rewards[action] = (0, 0.0)
+        super().__init__(num_actions)
+        self._action_total_rewards = np.zeros(num_actions)
 
     def add_reward(self, action, reward):
         """
         Updates the reward by counting the action has been taken and its reward
         """
-        occurrence, total_rewards = self._action_occurrence_total_rewards[action]
-        self._action_occurrence_total_rewards[action] = (occurrence + 1, total_rewards + reward)
+        old_value = self._q_a[action]
+        self._action_total_rewards[action] += reward
+        self._q_a[action] = self._action_total_rewards[action] / (self._occurrences[action] + 1)
+        self._record(action, reward, old_value)
 
-    def get_estimated_q_a(self):
-        """
-        :return: estimated q(a) for each action by averaging all the rewards for each action
-        """
-        all_rewards = {}
-        for action, occurrence_total_rewards in self._action_occurrence_total_rewards.items():
-            if occurrence_total_rewards[0] == 0:
-                all_rewards[action] = 0
-            else:
-                all_rewards[action] = occurrence_total_rewards[1] / occurrence_total_rewards[0]
-        return all_rewards
+    def _batch_values(self, actions, old_values, sorted_rewards, group, counts):
+        self._action_total_rewards[actions] += np.bincount(group, weights=sorted_rewards)
+        return self._action_total_rewards[actions] / (self._occurrences[actions] + counts)
 
-    def get_avg_reward(self):
+    def reset(self):
+        super().reset()
+        self._action_total_rewards.fill(0.0)
+
+
+class IncrementalRewardActionValueEstimator(ActionValueEstimator):
+    """
+    Averages the rewards for each action, but each reward is incrementally computed
+    """
+
+    def add_reward(self, action, reward):
         """
-        :return: estimated average rewards based on all the actions have been taken so far
+        Updates the reward incrementally
         """
-        total_occurrence = 0
-        total_rewards = 0.0
-        for occurrence, rewards in self._action_occurrence_total_rewards.values():
-            total_occurrence += occurrence
-            total_rewards += rewards
-        return total_rewards / total_occurrence
+        old_value = self._q_a[action]
+        self._q_a[action] = old_value + (reward - old_value) / (self._occurrences[action] + 1)
+        self._record(action, reward, old_value)
 
-    def reset(self):
+    def _batch_values(self, actions, old_values, sorted_rewards, group, counts):
+        return _incremental_values(old_values, self._occurrences[actions], sorted_rewards, group, counts)
+
+
+class ConstantStepSizeActionValueEstimator(ActionValueEstimator):
+    """
+    Similar to **IncrementalRewardActionValueEstimator**, but the step size is fixed.
+    """
+
+    def __init__(self, num_actions, alpha):
+        super().__init__(num_actions)
+        self._alpha = alpha
+
+    def add_reward(self, action, reward):
+        old_value = self._q_a[action]
+        self._q_a[action] = old_value + self._alpha * (reward - old_value)
+        self._record(action, reward, old_value)
+
+    def _batch_values(self, actions, old_values, sorted_rewards, group, counts):
+        return _constant_step_size_values(old_values, self._alpha, sorted_rewards, group, counts)
+
+
+class GradientBanditEstimator(ActionValueEstimator):
+    """
+    Learns a preference H(a) for each action by stochastic gradient ascent, to be used with
+    **SoftmaxActionSelector**. The estimated q(a) are the preferences.
+    :param baseline: use the average of the previous rewards as baseline
+    """
+
+    def __init__(self, num_actions, alpha, baseline=True):
+        super().__init__(num_actions)
+        self._alpha = alpha
+        self._baseline = baseline
+
+    def add_reward(self, action, reward):
+        if not self._baseline:
+            baseline = 0.0
+        elif self._counter == 0:
+            baseline = reward
+        else:
+            baseline = self._total_reward / self._counter
+
+        preferences = self._q_a
+        probabilities = np.exp(preferences - self._max_q_a)
+        probabilities /= probabilities.sum()
+        step = self._alpha * (reward - baseline)
+        preferences -= step * probabilities
+        preferences[action] += step
+
+        self._total_reward += reward
+        self._counter += 1
+        self._occurrences[action] += 1
+        self._find_greedy_actions()
+
+    def add_rewards(self, actions, rewards):
         """
-        Removes all estimated rewards
+        Every reward changes all preferences, so the rewards are added one by one.
         """
-        self._action_occurrence_total_rewards = {}
-        for action in range(0, self._num_actions):
-            self._action_occurrence_total_rewards[action] = (0, 0.0)
+        for action, reward in zip(actions, rewards):
+            self.add_reward(action, reward)
 
 
-class IncrementalRewardActionValueEstimator(ActionValueEstimator):
+class BatchActionValueEstimator:
     """
-    Averages the rewards for each action, but each reward is incrementally computed
+    Estimates the action values of all epochs at once. The state of every epoch is kept in an
+    (epochs, num_actions) array and every method takes or returns one entry per epoch.
     """
 
     def __init__(self, num_actions):
         self._num_actions = num_actions
-        self._action_occurrence_value = {}
-        for action in range(0, num_actions):
-            self._action_occurrence_value[action] = (0, 0.0)
+        self._q_a = None
+        self._total_rewards = None
+        self._counter = 0
 
-    def add_reward(self, action, reward):
+    @abstractmethod
+    def _update_q_a(self, actions, rewards):
+        pass
+
+    def add_reward(self, actions, rewards):
         """
-        Updates the reward incrementally
+        Updates the estimates with the action taken and the reward received in each epoch
         """
-        occurrence, value = self._action_occurrence_value[action]
-        occurrence += 1
-        value = value + (reward - value) / occurrence
-        self._action_occurrence_value[action] = (occurrence, value)
+        self._update_q_a(actions, rewards)
+        self._total_rewards += rewards
+        self._counter += 1
 
     def get_estimated_q_a(self):
-        return {action: occurrence_value[1] for action, occurrence_value in self._action_occurrence_value.items()}
+        """
+        :return: estimated q(a) as an (epochs, num_actions) array
+        """
+        return self._q_a
 
     def get_avg_reward(self):
-        total_occurrence = 0
-        total_rewards = 0.0
-        for occurrence, value in self._action_occurrence_value.values():
-            total_occurrence += occurrence
-            total_rewards += value * occurrence
-        return total_rewards / total_occurrence
+        """
+        :return: average reward of each epoch based on all the actions have been taken so far
+        """
+        return self._total_rewards / self._counter
 
-    def reset(self):
-        self._action_occurrence_value = {action: (0, 0.0) for action in self._action_occurrence_value}
+    def reset(self, epochs):
+        self._epochs_index = np.arange(epochs)
+        self._q_a = np.zeros((epochs, self._num_actions))
+        self._total_rewards = np.zeros(epochs)
+        self._counter = 0
 
 
-class ConstantStepSizeActionValueEstimator(ActionValueEstimator):
+class BatchAverageRewardsEstimator(BatchActionValueEstimator):
     """
-    Similar to **IncrementalRewardActionValueEstimator**, but the step size is fixed.
+    Batched version of **AverageRewardsEstimator**.
+    """
+
+    def _update_q_a(self, actions, rewards):
+        index = (self._epochs_index, actions)
+        self._occurrences[index] += 1
+        self._action_total_rewards[index] += rewards
+        self._q_a[index] = self._action_total_rewards[index] / self._occurrences[index]
+
+    def reset(self, epochs):
+        super().reset(epochs)
+        self._occurrences = np.zeros((epochs, self._num_actions), dtype=int)
+        self._action_total_rewards = np.zeros((epochs, self._num_actions))
+
+
+class BatchIncrementalRewardActionValueEstimator(BatchActionValueEstimator):
+    """
+    Batched version of **IncrementalRewardActionValueEstimator**.
+    """
+
+    def _update_q_a(self, actions, rewards):
+        index = (self._epochs_index, actions)
+        self._occurrences[index] += 1
+        self._q_a[index] += (rewards - self._q_a[index]) / self._occurrences[index]
+
+    def reset(self, epochs):
+        super().reset(epochs)
+        self._occurrences = np.zeros((epochs, self._num_actions), dtype=int)
+
+
+class BatchConstantStepSizeActionValueEstimator(BatchActionValueEstimator):
+    """
+    Batched version of **ConstantStepSizeActionValueEstimator**.
     """
 
     def __init__(self, num_actions, alpha):
-        self._num_actions = num_actions
+        super().__init__(num_actions)
         self._alpha = alpha
-        self._action_values = {}
-        self._counter = 0
+
+    def _update_q_a(self, actions, rewards):
+        index = (self._epochs_index, actions)
+        self._q_a[index] += self._alpha * (rewards - self._q_a[index])
+
+
+class CompactActionValueEstimator:
+    """
+    Estimates the action values of very many actions. Same interface as **ActionValueEstimator**, but the estimates
+    live in a **MaxTree** of :dtype: and the counts in int32. With float32 an action costs 20 bytes when num_actions
+    is a power of two and up to 36 otherwise, since the tree is padded to one; about 21 for a million actions.
+    Updating an estimate costs O(log num_actions) and the greedy action is found without scanning the actions. Used
+    with **CompactGreedyActionSelector**.
+    """
+
+    def __init__(self, num_actions, dtype=np.float32):
+        self._num_actions = num_actions
+        self._q_a = MaxTree(num_actions, dtype)
+        self._q_a_view = self._q_a.get_values().view()
+        self._q_a_view.flags.writeable = False
+        self._occurrences = array('i', bytes(4 * num_actions))
+        self._occurrences_view = np.frombuffer(self._occurrences, dtype=np.int32)
+        self._occurrences_view.flags.writeable = False
         self._total_reward = 0.0
-        for action in range(0, num_actions):
-            self._action_values[action] = 0.0
+        self._counter = 0
 
+    @abstractmethod
     def add_reward(self, action, reward):
-        value = self._action_values[action]
-        self._action_values[action] = value + self._alpha * (reward - value)
-        self._total_reward += reward
-        self._counter += 1
+        pass
+
+    def add_rewards(self, actions, rewards):
+        """
+        See **ActionValueEstimator.add_rewards**. Costs O(log num_actions) per distinct action of the batch.
+        """
+        if len(actions) == 0:
+            return
+        distinct, sorted_rewards, group, counts = _group_rewards(actions, rewards)
+        old_values = self._q_a_view[distinct].astype(float)
+        values = self._batch_values(distinct, old_values, sorted_rewards, group, counts)
+        for action, value in zip(distinct.tolist(), values.tolist()):
+            self._q_a[action] = value
+        np.frombuffer(self._occurrences, dtype=np.int32)[distinct] += counts
+        self._total_reward += float(sorted_rewards.sum())
+        self._counter += len(sorted_rewards)
+
+    @abstractmethod
+    def _batch_values(self, actions, old_values, sorted_rewards, group, counts):
+        """
+        See **ActionValueEstimator._batch_values**.
+        """
+        pass
 
     def get_estimated_q_a(self):
-        return self._action_values
+        """
+        :return: read-only view of the estimated q(a), indexed by action
+        """
+        return self._q_a_view
+
+    def get_action_counts(self):
+        """
+        :return: read-only view of the number of times each action has been taken
+        """
+        return self._occurrences_view
+
+    def get_greedy_action(self, uniform=0.0):
+        """
+        :param uniform: number in [0, 1) that breaks ties between greedy actions, each with the same probability
+        :return: an action with the highest estimated q(a)
+        """
+        return self._q_a.argmax(uniform)
+
+    def count_greedy_actions(self):
+        """
+        :return: number of actions with the highest estimated q(a)
+        """
+        return self._q_a.count_max()
+
+    def get_greedy_actions(self):
+        """
+        Scans all actions; **get_greedy_action** does not.
+        :return: the actions with the highest estimated q(a)
+        """
+        return np.flatnonzero(self._q_a_view == self._q_a.max()).tolist()
 
     def get_avg_reward(self):
+        """
+        :return: estimated average rewards based on all the actions have been taken so far
+        """
         return self._total_reward / self._counter
 
+    def get_steps(self):
+        """
+        :return: number of rewards added so far
+        """
+        return self._counter
+
     def reset(self):
-        self._action_values = {action: 0.0 for action in self._action_values}
+        self._q_a.fill(0.0)
+        self._occurrences[:] = array('i', bytes(4 * self._num_actions))
         self._total_reward = 0.0
         self._counter = 0
+
+    def _record(self, action, reward):
+        self._total_reward += reward
+        self._counter += 1
+        self._occurrences[action] += 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_q_a_view'], state['_occurrences_view']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._q_a_view = self._q_a.get_values().view()
+        self._q_a_view.flags.writeable = False
+        self._occurrences_view = np.frombuffer(self._occurrences, dtype=np.int32)
+        self._occurrences_view.flags.writeable = False
+
+
+class CompactIncrementalRewardActionValueEstimator(CompactActionValueEstimator):
+    """
+    **IncrementalRewardActionValueEstimator** for very many actions.
+    """
+
+    def add_reward(self, action, reward):
+        old_value = self._q_a[action]
+        self._q_a[action] = old_value + (reward - old_value) / (self._occurrences[action] + 1)
+        self._record(action, reward)
+
+    def _batch_values(self, actions, old_values, sorted_rewards, group, counts):
+        return _incremental_values(old_values, self._occurrences_view[actions], sorted_rewards, group, counts)
+
+
+class CompactConstantStepSizeActionValueEstimator(CompactActionValueEstimator):
+    """
+    **ConstantStepSizeActionValueEstimator** for very many actions.
+    """
+
+    def __init__(self, num_actions, alpha, dtype=np.float32):
+        super().__init__(num_actions, dtype)
+        self._alpha = alpha
+
+    def add_reward(self, action, reward):
+        old_value = self._q_a[action]
+        self._q_a[action] = old_value + self._alpha * (reward - old_value)
+        self._record(action, reward)
+
+    def _batch_values(self, actions, old_values, sorted_rewards, group, counts):
+        return _constant_step_size_values(old_values, self._alpha, sorted_rewards, group, counts)
+
+
+def _group_rewards(actions, rewards):
+    """
+    Groups a batch of rewards by action, keeping the order of the rewards of each action.
+    :return: (sorted distinct actions, rewards sorted by action, index into the distinct actions of every sorted
+    reward, number of rewards of every distinct action)
+    """
+    actions = np.asarray(actions)
+    order = np.argsort(actions, kind='stable')
+    distinct, group, counts = np.unique(actions[order], return_inverse=True, return_counts=True)
+    return distinct, np.asarray(rewards, dtype=float)[order], group, counts
+
+
+def _incremental_values(old_values, occurrences, sorted_rewards, group, counts):
+    """
+    Sample averages after adding the rewards to averages of :occurrences: rewards each.
+    """
+    return old_values + (np.bincount(group, weights=sorted_rewards) - counts * old_values) / (occurrences + counts)
+
+
+def _constant_step_size_values(old_values, alpha, sorted_rewards, group, counts):
+    """
+    Applying m updates q <- q + alpha * (r_i - q) in order gives
+    q_m = (1 - alpha)^m * q_0 + sum_i alpha * (1 - alpha)^(m - i) * r_i, for i = 1..m
+    so the later rewards of an action weigh more, as they would one update at a time.
+    """
+    starts = np.cumsum(counts) - counts
+    later_rewards = counts[group] - 1 - (np.arange(len(group)) - starts[group])
+    weights = alpha * (1 - alpha) ** later_rewards
+    return (1 - alpha) ** counts * old_values + np.bincount(group, weights=weights * sorted_rewards)
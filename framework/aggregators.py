@@ -0,0 +1,227 @@
+"""Streaming aggregation of the per step metrics of a run. The runners feed the average rewards and optimal actions of
+each epoch in blocks of steps, and the aggregators fold them into preallocated accumulators, so that memory does not
+grow with the number of epochs and no per epoch lists are built."""
+
+from abc import abstractmethod
+from collections import namedtuple
+from statistics import NormalDist
+
+import numpy as np
+
+StepStats = namedtuple('StepStats', ['steps', 'mean', 'std', 'lower', 'upper', 'optimal_action_pct'])
+
+
+class StepAggregator:
+    """
+    Aggregates blocks of per step metrics over epochs. Blocks are (epochs, n) arrays, or (n,) arrays for a single
+    epoch, starting at step :start:. Once all blocks of the epochs are added, **end_epoch** is called with the number of
+    epochs. Aggregators of disjoint epochs can be combined with **merge**.
+    """
+
+    @abstractmethod
+    def start(self, steps):
+        pass
+
+    @abstractmethod
+    def add_block(self, start, avg_rewards, optimal_actions=None):
+        pass
+
+    @abstractmethod
+    def end_epoch(self, epochs=1):
+        pass
+
+    @abstractmethod
+    def merge(self, other):
+        pass
+
+    @abstractmethod
+    def get_result(self):
+        pass
+
+    @abstractmethod
+    def extend(self, previous, previous_steps):
+        """
+        Takes the statistics of the first :previous_steps: steps from :previous:, the aggregator of a run of the same
+        epochs over :previous_steps: steps. The aggregator is then only given the blocks after :previous_steps:.
+        :return: self
+        """
+        pass
+
+
+class StepStatsAggregator(StepAggregator):
+    """
+    Online mean, variance and confidence band of the average reward for every step, using Welford's algorithm over
+    epochs. Only every k-th step is kept when :every: is larger than 1.
+    :param confidence: the confidence level of the band around the mean
+    """
+
+    def __init__(self, every=1, confidence=0.95):
+        self._every = every
+        self._confidence = confidence
+        self._epochs = 0
+        self._steps = None
+        self._mean = None
+        self._m2 = None
+        self._optimal_actions = None
+
+    def start(self, steps):
+        self._epochs = 0
+        self._steps = np.arange(0, steps, self._every)
+        self._mean = np.zeros(len(self._steps))
+        self._m2 = np.zeros(len(self._steps))
+        self._optimal_actions = None
+
+    def add_block(self, start, avg_rewards, optimal_actions=None):
+        avg_rewards = np.atleast_2d(avg_rewards)
+        first = -start % self._every
+        values = avg_rewards[:, first::self._every]
+        begin = (start + first) // self._every
+        index = slice(begin, begin + values.shape[1])
+
+        # Chan's parallel update with the block as a sample of values.shape[0] epochs
+        n_a, n_b = self._epochs, values.shape[0]
+        n = n_a + n_b
+        block_mean = values.mean(axis=0)
+        delta = block_mean - self._mean[index]
+        self._mean[index] += delta * n_b / n
+        self._m2[index] += ((values - block_mean) ** 2).sum(axis=0) + delta ** 2 * n_a * n_b / n
+
+        if optimal_actions is not None:
+            if self._optimal_actions is None:
+                self._optimal_actions = np.zeros(len(self._steps), dtype=np.int64)
+            self._optimal_actions[index] += np.atleast_2d(optimal_actions)[:, first::self._every].sum(axis=0)
+
+    def end_epoch(self, epochs=1):
+        self._epochs += epochs
+
+    def merge(self, other):
+        n_a, n_b = self._epochs, other._epochs
+        n = n_a + n_b
+        if n_b == 0:
+            return self
+        delta = other._mean - self._mean
+        self._mean += delta * n_b / n
+        self._m2 += other._m2 + delta ** 2 * n_a * n_b / n
+        if other._optimal_actions is not None:
+            if self._optimal_actions is None:
+                self._optimal_actions = np.zeros(len(self._steps), dtype=np.int64)
+            self._optimal_actions += other._optimal_actions
+        self._epochs = n
+        return self
+
+    def extend(self, previous, previous_steps):
+        kept = len(previous._steps)
+        self._mean[:kept] = previous._mean
+        self._m2[:kept] = previous._m2
+        if previous._optimal_actions is not None:
+            if self._optimal_actions is None:
+                self._optimal_actions = np.zeros(len(self._steps), dtype=np.int64)
+            self._optimal_actions[:kept] = previous._optimal_actions
+        return self
+
+    def get_result(self):
+        """
+        :return: **StepStats** with the kept steps, mean, standard deviation, confidence band and optimal action
+        percentage (empty if the reward does not have an optimal action)
+        """
+        std = np.sqrt(self._m2 / (self._epochs - 1)) if self._epochs > 1 else np.zeros(len(self._steps))
+        half_width = NormalDist().inv_cdf((1 + self._confidence) / 2) * std / np.sqrt(self._epochs)
+        return StepStats(self._steps, self._mean, std, self._mean - half_width, self._mean + half_width,
+                         self._get_optimal_action_pct())
+
+    def _get_optimal_action_pct(self):
+        if self._optimal_actions is None:
+            return np.array([])
+        return self._optimal_actions / self._epochs
+
+
+class AvgPerStepAggregator(StepStatsAggregator):
+    """
+    Returns the average reward per epoch for every step and the optimal action percentage per epoch for every step.
+    """
+
+    def get_result(self):
+        return self._mean, self._get_optimal_action_pct()
+
+
+class TrailingAvgAggregator(StepAggregator):
+    """
+    Returns the average reward of the trailing N steps, specified by :trailing_steps:. Only keeps a running sum per
+    epoch, so memory does not depend on the number of steps.
+    """
+
+    def __init__(self, trailing_steps, confidence=0.95):
+        self._trailing_steps = trailing_steps
+        self._confidence = confidence
+        self._first_step = None
+        self._epoch_sums = 0.0
+        self._epochs = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def start(self, steps):
+        self._first_step = max(0, steps - self._trailing_steps)
+        self._epoch_sums = 0.0
+        self._epochs = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def add_block(self, start, avg_rewards, optimal_actions=None):
+        first = max(0, self._first_step - start)
+        self._epoch_sums = self._epoch_sums + np.atleast_2d(avg_rewards)[:, first:].sum(axis=1)
+
+    def end_epoch(self, epochs=1):
+        values = np.broadcast_to(self._epoch_sums, (epochs,)) / self._trailing_steps
+        n_a, n_b = self._epochs, epochs
+        n = n_a + n_b
+        block_mean = values.mean()
+        delta = block_mean - self._mean
+        self._mean += delta * n_b / n
+        self._m2 += ((values - block_mean) ** 2).sum() + delta ** 2 * n_a * n_b / n
+        self._epochs = n
+        self._epoch_sums = 0.0
+
+    def merge(self, other):
+        n_a, n_b = self._epochs, other._epochs
+        n = n_a + n_b
+        if n_b == 0:
+            return self
+        delta = other._mean - self._mean
+        self._mean += delta * n_b / n
+        self._m2 += other._m2 + delta ** 2 * n_a * n_b / n
+        self._epochs = n
+        return self
+
+    def extend(self, previous, previous_steps):
+        """
+        Only possible when the trailing steps all lie after :previous_steps:, as the rewards of earlier steps are gone.
+        """
+        if self._first_step < previous_steps:
+            raise ValueError("The trailing {} steps include steps of the previous run".format(self._trailing_steps))
+        return self
+
+    def get_result(self):
+        return self._mean
+
+    def get_confidence_interval(self):
+        """
+        :return: (lower, upper) confidence interval of the trailing average reward over epochs
+        """
+        std = np.sqrt(self._m2 / (self._epochs - 1)) if self._epochs > 1 else 0.0
+        half_width = NormalDist().inv_cdf((1 + self._confidence) / 2) * std / np.sqrt(self._epochs)
+        return self._mean - half_width, self._mean + half_width
+
+
+def make_aggregator(aggregator=None, trailing_steps=None):
+    """
+    :param aggregator: a **StepAggregator**, or 'avg_per_step' (default) or 'trailing_avg' which needs
+    :trailing_steps:
+    :return: a new aggregator
+    """
+    if isinstance(aggregator, StepAggregator):
+        return aggregator
+    if aggregator is None or aggregator == 'avg_per_step':
+        return AvgPerStepAggregator()
+    elif aggregator == 'trailing_avg':
+        return TrailingAvgAggregator(trailing_steps)
+    raise ValueError("Unknown aggregator: {}".format(aggregator))
@@ -0,0 +1,180 @@
+"""Checkpoints of long bandit runs. A checkpointed run gives every epoch its own random stream, spawned from the seed of
+the run, so that an epoch only depends on its own state: the components, the state of the random generators and the
+position of the block samplers in their blocks. The checkpoint keeps that state for the epoch in progress, next to the
+aggregator, so that a run can be resumed after a crash with the same results as an uninterrupted run. An extendable
+run also keeps the state at the end of every finished epoch, so that it can be extended by more steps; those states
+are appended to a second file, <path>.epochs, instead of being written again with every save."""
+
+import copy
+import io
+import os
+import pickle
+import random
+
+import numpy as np
+
+from framework.sampling import BlockSampler
+
+
+class RunCheckpoint:
+    """
+    Progress of a checkpointed run of :epochs: epochs of :steps: steps.
+    :param components: (action reward, action value estimator, action selector) the epochs start from
+    :param aggregator: **StepAggregator** of the run, not started yet
+    :param extendable: keep the end state of every epoch, see **extend**
+    """
+
+    def __init__(self, components, aggregator, epochs, steps, seed=None, extendable=False):
+        self.epochs = epochs
+        self.steps = steps
+        self.entropy = np.random.SeedSequence(seed).entropy
+        # Plain pickles drop the pending random numbers, so every epoch starts with empty block samplers
+        self.initial_components = pickle.dumps(components)
+        self.pristine_aggregator = copy.deepcopy(aggregator)
+        self.aggregator = aggregator
+        self.aggregator.start(steps)
+        # First step of every epoch, larger than 0 if the run extends an earlier run
+        self.first_step = 0
+        # Epoch in progress, its finished steps and its state, None if it has not started
+        self.epoch = 0
+        self.step = 0
+        self.state = None
+        # Offset in the epochs file of the state at the end of every finished epoch, if the run is extendable, and the
+        # states not saved there yet
+        self.extendable = extendable
+        self.epoch_offsets = []
+        self._new_epoch_states = {}
+        self._epochs_path = None
+        # A new run starts a new epochs file
+        self._epochs_file_started = False
+
+    def is_complete(self):
+        return self.epoch == self.epochs
+
+    def start_epoch(self):
+        """
+        :return: the components of the epoch in progress, with the random generators set to its state
+        """
+        if self.state is not None:
+            return restore_state(self.state)
+        if self.first_step > 0:
+            return restore_state(self._get_epoch_state(self.epoch))
+        seed_sequence = np.random.SeedSequence(self.entropy, spawn_key=(self.epoch,))
+        np.random.seed(seed_sequence.generate_state(4))
+        random.seed(int(seed_sequence.generate_state(1)[0]))
+        return pickle.loads(self.initial_components)
+
+    def end_block(self, components, step):
+        self.step = step
+        self.state = capture_state(components)
+
+    def end_epoch(self, components):
+        if self.extendable:
+            self._new_epoch_states[self.epoch] = capture_state(components)
+        self.epoch += 1
+        self.step = self.first_step
+        self.state = None
+
+    def extend(self, steps):
+        """
+        Turns a complete run into a run of :steps: steps per epoch, whose epochs continue from their end states.
+        """
+        if not self.extendable:
+            raise ValueError("Only an extendable run can be extended; it does not keep the end states of its epochs")
+        if not self.is_complete():
+            raise ValueError("Only a complete run can be extended; resume it first")
+        if steps <= self.steps:
+            raise ValueError("A run of {} steps cannot be extended to {} steps".format(self.steps, steps))
+        aggregator = copy.deepcopy(self.pristine_aggregator)
+        aggregator.start(steps)
+        self.aggregator = aggregator.extend(self.aggregator, self.steps)
+        self.first_step = self.steps
+        self.steps = steps
+        self.epoch = 0
+        self.step = self.first_step
+
+    def save(self, path):
+        """
+        Appends the new end states of the epochs to <path>.epochs, then writes the checkpoint to a temporary file first,
+        so an interrupted save keeps the previous checkpoint. States appended by an interrupted save are never read.
+        """
+        if self._new_epoch_states:
+            with open(path + '.epochs', 'ab' if self._epochs_file_started else 'wb') as f:
+                for epoch, state in sorted(self._new_epoch_states.items()):
+                    if epoch == len(self.epoch_offsets):
+                        self.epoch_offsets.append(f.tell())
+                    else:
+                        self.epoch_offsets[epoch] = f.tell()
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self._epochs_file_started = True
+            self._new_epoch_states = {}
+            self._epochs_path = path + '.epochs'
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            run = pickle.load(f)
+        run._epochs_path = path + '.epochs'
+        return run
+
+    def _get_epoch_state(self, epoch):
+        if epoch in self._new_epoch_states:
+            return self._new_epoch_states[epoch]
+        with open(self._epochs_path, 'rb') as f:
+            f.seek(self.epoch_offsets[epoch])
+            return pickle.load(f)
+
+    def __getstate__(self):
+        # The new end states are appended to the epochs file by save, before the checkpoint is written
+        state = self.__dict__.copy()
+        del state['_new_epoch_states'], state['_epochs_path']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._new_epoch_states = {}
+        self._epochs_path = None
+
+
+class _StatePickler(pickle.Pickler):
+    """
+    Keeps the position of the block samplers in their blocks, which they drop when they are pickled.
+    """
+
+    def reducer_override(self, obj):
+        if isinstance(obj, BlockSampler):
+            return _restore_sampler, (obj.__getstate__(), obj.get_position())
+        return NotImplemented
+
+
+def _restore_sampler(state, position):
+    sampler = BlockSampler.__new__(BlockSampler)
+    sampler.__dict__.update(state)
+    sampler.set_position(position)
+    return sampler
+
+
+def capture_state(components):
+    """
+    :return: bytes holding the components, the positions of their block samplers and the state of the global random
+    generators
+    """
+    with io.BytesIO() as buffer:
+        _StatePickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(
+            (components, np.random.get_state(legacy=False), random.getstate()))
+        return buffer.getvalue()
+
+
+def restore_state(state):
+    """
+    Sets the global random generators to the state captured by **capture_state**.
+    :return: the components
+    """
+    components, numpy_state, python_state = pickle.loads(state)
+    np.random.set_state(numpy_state)
+    random.setstate(python_state)
+    return components
@@ -0,0 +1,126 @@
+"""Indexed maximum over a large array of values. A segment tree keeps the maximum of every range of values and the
+number of values equal to it, so that changing one value costs O(log n) and the maximum, or a uniformly chosen value
+equal to it, is found in O(log n) without touching the other values. The tree lives in compact array.array buffers of
+the requested dtype, and the values are readable as a numpy view."""
+
+import math
+from array import array
+
+import numpy as np
+
+
+class MaxTree:
+    """
+    :param size: number of values, all 0 at first
+    :param dtype: np.float32 or np.float64
+    """
+
+    def __init__(self, size, dtype=np.float32):
+        self._size = size
+        self._dtype = np.dtype(dtype)
+        self._leaves = 1 << max(0, math.ceil(math.log2(max(size, 1))))
+        # Node i has children 2i and 2i + 1; the leaves start at self._leaves
+        self._max = array(self._dtype.char, bytes(2 * self._leaves * self._dtype.itemsize))
+        self._count = array('i', bytes(2 * self._leaves * 4))
+        self._max_view = np.frombuffer(self._max, dtype=self._dtype)
+        self._count_view = np.frombuffer(self._count, dtype=np.int32)
+        self._values = self._max_view[self._leaves:self._leaves + size]
+        self.fill(0.0)
+
+    def get_values(self):
+        """
+        :return: numpy view of the values; writing to it requires calling **rebuild** afterwards
+        """
+        return self._values
+
+    def fill(self, value):
+        self._values.fill(value)
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Recomputes the tree from the values, level by level, in O(n).
+        """
+        maxima = self._max_view
+        counts = self._count_view
+        maxima[self._leaves + self._size:] = -np.inf
+        counts[self._leaves:] = 0
+        counts[self._leaves:self._leaves + self._size] = 1
+        first = self._leaves
+        while first > 1:
+            parents = slice(first // 2, first)
+            left_max, right_max = maxima[first:2 * first:2], maxima[first + 1:2 * first:2]
+            left_count, right_count = counts[first:2 * first:2], counts[first + 1:2 * first:2]
+            maxima[parents] = np.maximum(left_max, right_max)
+            counts[parents] = np.where(left_max > right_max, left_count,
+                                       np.where(right_max > left_max, right_count, left_count + right_count))
+            first //= 2
+
+    def __getitem__(self, index):
+        return self._max[self._leaves + index]
+
+    def __setitem__(self, index, value):
+        """
+        Sets one value and updates its ancestors, stopping at the first one that does not change.
+        """
+        maxima = self._max
+        counts = self._count
+        node = self._leaves + index
+        maxima[node] = value
+        node >>= 1
+        while node:
+            left = 2 * node
+            left_max, right_max = maxima[left], maxima[left + 1]
+            if left_max > right_max:
+                node_max, node_count = left_max, counts[left]
+            elif right_max > left_max:
+                node_max, node_count = right_max, counts[left + 1]
+            else:
+                node_max, node_count = left_max, counts[left] + counts[left + 1]
+            if maxima[node] == node_max and counts[node] == node_count:
+                break
+            maxima[node] = node_max
+            counts[node] = node_count
+            node >>= 1
+
+    def max(self):
+        return self._max[1]
+
+    def count_max(self):
+        """
+        :return: number of values equal to the maximum
+        """
+        return self._count[1]
+
+    def argmax(self, uniform=0.0):
+        """
+        :param uniform: number in [0, 1) choosing among the values equal to the maximum, each with the same probability
+        :return: index of a value equal to the maximum
+        """
+        maxima = self._max
+        counts = self._count
+        node = 1
+        node_max = maxima[1]
+        rank = int(uniform * counts[1])
+        while node < self._leaves:
+            left = 2 * node
+            if maxima[left] == node_max:
+                if rank < counts[left]:
+                    node = left
+                    continue
+                rank -= counts[left]
+            node = left + 1
+        return node - self._leaves
+
+    def __getstate__(self):
+        # The numpy views cannot be pickled; they are recreated from the buffers
+        state = self.__dict__.copy()
+        for name in ('_max_view', '_count_view', '_values'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._max_view = np.frombuffer(self._max, dtype=self._dtype)
+        self._count_view = np.frombuffer(self._count, dtype=np.int32)
+        self._values = self._max_view[self._leaves:self._leaves + self._size]
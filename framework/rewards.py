@@ -1,7 +1,10 @@
+import math
 from abc import abstractmethod
 
 import numpy as np
 
+from framework.sampling import BlockSampler
+
 
 class ActionReward:
     """
@@ -12,6 +15,13 @@ class ActionReward:
     def get_reward(self, action):
         pass
 
+    @abstractmethod
+    def get_rewards(self, actions):
+        """
+        :return: the rewards of taking the actions one after another, as an array
+        """
+        pass
+
     @abstractmethod
     def get_optimal_action(self):
         pass
@@ -23,16 +33,19 @@ class ActionReward:
 
 class NormalDistributionReward(ActionReward):
     """
-    Generates rewards for each action.
+    Generates rewards for each action. The noise is drawn in blocks of :block_size:.
+    :param dtype: dtype of the mean reward of each action, np.float32 halves the memory for very many actions
     """
 
-    def __init__(self, num_actions):
+    def __init__(self, num_actions, block_size=4096, dtype=np.float64):
         self._num_actions = num_actions
+        self._dtype = dtype
+        self._noise = BlockSampler('standard_normal', block_size=block_size)
         self._generate_reward_distribution(num_actions)
         # print("true q_a mean: {} with optimal action: {}".format(self._q_a_means, self._optimal_action))
 
     def _generate_reward_distribution(self, num_actions):
-        self._q_a_means = np.random.randn(num_actions)
+        self._q_a_means = np.random.randn(num_actions).astype(self._dtype, copy=False)
         self._optimal_action = np.argmax(self._q_a_means)
 
     def get_reward(self, action):
@@ -40,7 +53,11 @@ class NormalDistributionReward(ActionReward):
         Reward distribution is a normal distribution with unit variance, but different mean value.
         :return: a reward for an action
         """
-        return np.random.randn() + self._q_a_means[action]
+        return self._noise.next() + float(self._q_a_means[action])
+
+    def get_rewards(self, actions):
+        actions = np.asarray(actions)
+        return self._noise.take(len(actions)) + self._q_a_means[actions]
 
     def get_optimal_action(self):
         return self._optimal_action
@@ -53,21 +70,68 @@ class RandomWalkActionReward(ActionReward):
     """
     All q_a start out equal and take independent random walks (by adding a normally distributed increment with mean zero
     and standard deviation 0.01 to all the q_a on each step).
+
+    The walk is lazy: the increments an action missed since it was last taken add up to a single normal increment
+    with variance 0.01 ** 2 * missed steps, so that only the taken action is brought up to date and a step costs the
+    same for any number of actions.
+    :param dtype: dtype of the q_a, np.float32 halves their memory for very many actions
     """
 
-    def __init__(self, init_q_a, num_actions):
+    def __init__(self, init_q_a, num_actions, block_size=4096, dtype=np.float64):
         self._init_q_a = init_q_a
         self._num_actions = num_actions
-        self._q_a = np.array([init_q_a] * num_actions)
+        self._drift = BlockSampler('standard_normal', block_size=block_size)
+        self._q_a = np.full(num_actions, init_q_a, dtype=dtype)
+        # Number of increments already added to each q_a
+        self._q_a_steps = np.zeros(num_actions, dtype=np.int64)
+        self._step = 0
 
     def get_reward(self, action):
         """
         Add a normal distribution N(0, 0.01 ** 2) to reward on each step.
         :return: the reward
         """
-        reward = self._q_a[action]
-        self._q_a = np.random.randn(10) * 0.01 + self._q_a
-        return reward
+        missed_steps = self._step - self._q_a_steps[action]
+        if missed_steps > 0:
+            self._q_a[action] += 0.01 * math.sqrt(missed_steps) * self._drift.next()
+            self._q_a_steps[action] = self._step
+        self._step += 1
+        return float(self._q_a[action])
+
+    def get_rewards(self, actions):
+        """
+        Takes the actions on consecutive steps. Pulls of the same action are grouped, and the cumulative sum of their
+        increments gives the q_a at each pull.
+        :return: the rewards
+        """
+        actions = np.asarray(actions)
+        num_rewards = len(actions)
+        if num_rewards == 0:
+            return np.empty(0)
+
+        order = np.argsort(actions, kind='stable')
+        sorted_actions = actions[order]
+        sorted_steps = self._step + order
+        group_first = np.ones(num_rewards, dtype=bool)
+        group_first[1:] = sorted_actions[1:] != sorted_actions[:-1]
+        group_starts = np.flatnonzero(group_first)
+        group_ends = np.append(group_starts[1:], num_rewards) - 1
+
+        previous_steps = np.empty(num_rewards, dtype=np.int64)
+        previous_steps[1:] = sorted_steps[:-1]
+        previous_steps[group_starts] = self._q_a_steps[sorted_actions[group_starts]]
+        drift = 0.01 * np.sqrt(sorted_steps - previous_steps) * self._drift.take(num_rewards)
+        cumulative_drift = np.cumsum(drift)
+        group_offsets = cumulative_drift[group_starts] - drift[group_starts]
+        values = self._q_a[sorted_actions] + cumulative_drift - np.repeat(group_offsets, group_ends - group_starts + 1)
+
+        self._q_a[sorted_actions[group_ends]] = values[group_ends]
+        self._q_a_steps[sorted_actions[group_ends]] = sorted_steps[group_ends]
+        self._step += num_rewards
+
+        rewards = np.empty(num_rewards)
+        rewards[order] = values
+        return rewards
 
     def get_optimal_action(self):
         """
@@ -77,4 +141,73 @@ class RandomWalkActionReward(ActionReward):
         return None
 
     def reset(self):
-        self._q_a = np.array([self._init_q_a] * self._num_actions)
+        self._q_a.fill(self._init_q_a)
+        self._q_a_steps.fill(0)
+        self._step = 0
+
+
+class BatchNormalDistributionReward:
+    """
+    Batched version of **NormalDistributionReward**. Holds the reward distribution of every epoch in an
+    (epochs, num_actions) array, so that one call generates the rewards of all epochs.
+    """
+
+    def __init__(self, num_actions):
+        self._num_actions = num_actions
+        self._q_a_means = None
+        self._optimal_actions = None
+        self._epochs = None
+
+    def get_reward(self, actions):
+        """
+        Reward distribution is a normal distribution with unit variance, but different mean value.
+        :param actions: the action taken in each epoch
+        :return: a reward for each epoch
+        """
+        return np.random.randn(self._epochs) + self._q_a_means[self._epochs_index, actions]
+
+    def get_optimal_action(self):
+        """
+        :return: the optimal action of each epoch
+        """
+        return self._optimal_actions
+
+    def reset(self, epochs):
+        self._epochs = epochs
+        self._epochs_index = np.arange(epochs)
+        self._q_a_means = np.random.randn(epochs, self._num_actions)
+        self._optimal_actions = np.argmax(self._q_a_means, axis=1)
+
+
+class BatchRandomWalkActionReward:
+    """
+    Batched version of **RandomWalkActionReward**. The q_a of all epochs take their random walks together.
+    """
+
+    def __init__(self, init_q_a, num_actions):
+        self._init_q_a = init_q_a
+        self._num_actions = num_actions
+        self._q_a = None
+        self._epochs = None
+
+    def get_reward(self, actions):
+        """
+        Add a normal distribution N(0, 0.01 ** 2) to reward on each step.
+        :param actions: the action taken in each epoch
+        :return: the reward for each epoch
+        """
+        rewards = self._q_a[self._epochs_index, actions]
+        self._q_a += np.random.randn(self._epochs, self._num_actions) * 0.01
+        return rewards
+
+    def get_optimal_action(self):
+        """
+        Does not have an optimal action; all actions are optimal
+        :return: None
+        """
+        return None
+
+    def reset(self, epochs):
+        self._epochs = epochs
+        self._epochs_index = np.arange(epochs)
+        self._q_a = np.full((epochs, self._num_actions), self._init_q_a, dtype=float)
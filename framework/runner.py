@@ -1,58 +1,313 @@
+import copy
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
+from framework.aggregators import make_aggregator
+from framework.checkpoint import RunCheckpoint
+from framework.telemetry import PHASES, ProgressReporter
+
 
 class Runner:
-    def __init__(self, action_reward, action_value_estimator, action_selector):
+    """
+    :param block_size: number of steps buffered before they are handed to the aggregator
+    :param observers: **RunnerObserver** instances receiving telemetry of the runs
+    """
+
+    def __init__(self, action_reward, action_value_estimator, action_selector, block_size=4096, observers=None):
         self._action_reward = action_reward
         self._action_value_estimator = action_value_estimator
         self._action_selector = action_selector
+        self._block_size = block_size
+        self._observers = list(observers or [])
+
+    def add_observer(self, observer):
+        self._observers.append(observer)
 
     def run_steps(self, steps=1000):
         """
         Runs simulation with number of steps.
         :return: the average reward for each step and optimal action for each step
         """
-        # reset to have a fresh start in each epoch
-        self._action_value_estimator.reset()
-        self._action_reward.reset()
-
-        avg_rewards = []
+        avg_rewards = np.empty(steps)
         # indicate if an optimal action is made for each step
-        optimal_actions = []
+        optimal_actions = np.empty(0, dtype=np.int8)
+
+        for start, block_avg_rewards, block_optimal_actions in self._run_blocks(steps):
+            avg_rewards[start:start + len(block_avg_rewards)] = block_avg_rewards
+            if block_optimal_actions is not None:
+                if len(optimal_actions) == 0:
+                    optimal_actions = np.empty(steps, dtype=np.int8)
+                optimal_actions[start:start + len(block_optimal_actions)] = block_optimal_actions
+
+        return avg_rewards, optimal_actions
+
+    def _run_blocks(self, steps, phase_times=None, first_step=0):
+        """
+        Runs simulation with number of steps, writing the metrics into preallocated buffers. The time of each phase is
+        added to :phase_times: if given. With :first_step: larger than 0, the epoch continues from the current state
+        of the components; the blocks keep the boundaries they have when the epoch starts from step 0.
+        :return: generator of (start step, average rewards, optimal actions or None) for each block of steps; the
+        buffers are reused by the next block
+        """
+        if first_step == 0:
+            # reset to have a fresh start in each epoch
+            self._action_value_estimator.reset()
+            self._action_reward.reset()
+
+        has_optimal_action = self._action_reward.get_optimal_action() is not None
+        block_size = max(1, min(self._block_size, steps))
+        avg_rewards = np.empty(block_size)
+        optimal_actions = np.empty(block_size, dtype=np.int8) if has_optimal_action else None
+
+        for block_start in range(first_step - first_step % block_size, steps, block_size):
+            start = max(block_start, first_step)
+            block_steps = min(block_start + block_size, steps) - start
+            if phase_times is None:
+                for step in range(0, block_steps):
+                    action = self._action_selector.select_action()
+                    if has_optimal_action:
+                        optimal_actions[step] = action == self._action_reward.get_optimal_action()
+                    reward = self._action_reward.get_reward(action)
+                    self._action_value_estimator.add_reward(action, reward)
+                    avg_rewards[step] = self._action_value_estimator.get_avg_reward()
+            else:
+                self._run_profiled_block(block_steps, avg_rewards, optimal_actions, phase_times)
+
+            yield start, avg_rewards[:block_steps], None if optimal_actions is None else optimal_actions[:block_steps]
 
-        for step in range(0, steps):
+    def _run_profiled_block(self, block_steps, avg_rewards, optimal_actions, phase_times):
+        """
+        Same as the loop in **_run_blocks**, but times every phase of every step.
+        """
+        select_time = reward_time = update_time = aggregate_time = 0.0
+        for step in range(0, block_steps):
+            time_0 = time.perf_counter()
             action = self._action_selector.select_action()
-            if self._action_reward.get_optimal_action() is not None:
-                if action == self._action_reward.get_optimal_action():
-                    optimal_actions.append(1)
-                else:
-                    optimal_actions.append(0)
+            time_1 = time.perf_counter()
             reward = self._action_reward.get_reward(action)
-            # print("Selected action: {} with record: {}".format(action, reward))
+            time_2 = time.perf_counter()
             self._action_value_estimator.add_reward(action, reward)
-            avg_rewards.append(self._action_value_estimator.get_avg_reward())
+            time_3 = time.perf_counter()
+            if optimal_actions is not None:
+                optimal_actions[step] = action == self._action_reward.get_optimal_action()
+            avg_rewards[step] = self._action_value_estimator.get_avg_reward()
+            time_4 = time.perf_counter()
+            select_time += time_1 - time_0
+            reward_time += time_2 - time_1
+            update_time += time_3 - time_2
+            aggregate_time += time_4 - time_3
 
-        return avg_rewards, optimal_actions
+        phase_times['select'] += select_time
+        phase_times['reward'] += reward_time
+        phase_times['update'] += update_time
+        phase_times['aggregate'] += aggregate_time
 
     def run_epochs(self, epochs=2000, steps=1000, meter=200, **kwargs):
         """
-        Runs simulation with number of epochs. :meter: decides the frequency of printing out epoch number 
-        :aggregator: 'avg_per_step' returns the average reward per epoch for every step, the optimal action 
-        percentage per epoch for every step. 'trailing_steps' returns the average rewards of the trailing N stpes, specificed by 'trailing_steps' 
+        Runs simulation with number of epochs. :meter: decides the frequency of reporting progress to stdout, None
+        turns it off; use a **ProgressReporter** observer to report elsewhere.
+        :aggregator: 'avg_per_step' returns the average reward per epoch for every step, the optimal action
+        percentage per epoch for every step. 'trailing_avg' returns the average rewards of the trailing N steps,
+        specified by 'trailing_steps'. Any **StepAggregator** can be given as well.
         """
-        total_avg_rewards = [0.0] * steps
-        total_optimal_actions = [0] * steps
+        aggregator = make_aggregator(**kwargs)
+        aggregator.start(steps)
+        observers = self._observers + ([ProgressReporter(meter)] if meter else [])
+        if not observers:
+            for epoch in range(0, epochs):
+                self._run_epoch(aggregator, steps)
+            return aggregator.get_result()
 
+        measures_phases = any(observer.measures_phases for observer in observers)
+        for observer in observers:
+            observer.on_run_start(epochs, steps)
+        start_time = time.perf_counter()
         for epoch in range(0, epochs):
-            if epoch > 0 and epoch % meter == 0:
-                print("Running epoch: {}".format(epoch))
-            avg_rewards, optimal_actions = self.run_steps(steps)
-            total_avg_rewards = [x + y for x, y in zip(total_avg_rewards, avg_rewards)]
-            total_optimal_actions = [x + y for x, y in zip(total_optimal_actions, optimal_actions)]
-
-        aggregator_type = kwargs.get('aggregator')
-        if aggregator_type is None or aggregator_type == 'avg_per_step':
-            return np.array(total_avg_rewards) / epochs, np.array(total_optimal_actions) / epochs
-        elif aggregator_type == 'trailing_avg':
-            trailing_steps = kwargs.get('trailing_steps')
-            return sum(total_avg_rewards[-trailing_steps:]) / trailing_steps / epochs
+            phase_times = dict.fromkeys(PHASES, 0.0) if measures_phases else None
+            self._run_epoch(aggregator, steps, phase_times)
+            elapsed = time.perf_counter() - start_time
+            for observer in observers:
+                observer.on_epoch_end(epoch, steps, elapsed, phase_times)
+        for observer in observers:
+            observer.on_run_end(epochs, steps, time.perf_counter() - start_time)
+
+        return aggregator.get_result()
+
+    def run_checkpointed(self, checkpoint, epochs=2000, steps=1000, seed=None, checkpoint_every=60.0,
+                         extendable=False, **kwargs):
+        """
+        Runs simulation with number of epochs like **run_epochs**, and saves the progress to the file :checkpoint:
+        every :checkpoint_every: seconds and when the run is complete; None saves nothing. Every epoch draws from its
+        own random stream spawned from :seed:, so the results only depend on :seed:, with or without a checkpoint.
+        Takes the same aggregator arguments as **run_epochs**. Observers are told about every epoch, without phase
+        timings.
+        :param extendable: also keep the end state of every epoch, in :checkpoint:.epochs, so that the run can be
+        continued by **extend**
+        """
+        run = RunCheckpoint((self._action_reward, self._action_value_estimator, self._action_selector),
+                            make_aggregator(**kwargs), epochs, steps, seed, extendable)
+        return self._run_checkpoint(run, checkpoint, checkpoint_every)
+
+    def resume(self, checkpoint, checkpoint_every=60.0):
+        """
+        Continues the run saved in :checkpoint: where it stopped. The results are those of an uninterrupted run. The
+        runner continues with the components saved in the checkpoint.
+        :return: the result of the aggregator of the run
+        """
+        return self._run_checkpoint(RunCheckpoint.load(checkpoint), checkpoint, checkpoint_every)
+
+    def extend(self, checkpoint, steps, checkpoint_every=60.0):
+        """
+        Continues every epoch of the complete extendable run saved in :checkpoint: up to :steps: steps. The results are
+        those of an uninterrupted run of :steps: steps, if the aggregator can be extended (see
+        **StepAggregator.extend**).
+        :return: the result of the aggregator of the extended run
+        """
+        run = RunCheckpoint.load(checkpoint)
+        run.extend(steps)
+        return self._run_checkpoint(run, checkpoint, checkpoint_every)
+
+    def _run_checkpoint(self, run, path, checkpoint_every):
+        observers = list(self._observers)
+        for observer in observers:
+            observer.on_run_start(run.epochs, run.steps)
+        start_time = last_save = time.perf_counter()
+        while not run.is_complete():
+            self._action_reward, self._action_value_estimator, self._action_selector = components = run.start_epoch()
+            for start, avg_rewards, optimal_actions in self._run_blocks(run.steps, first_step=run.step):
+                run.aggregator.add_block(start, avg_rewards, optimal_actions)
+                if path is not None and time.perf_counter() - last_save >= checkpoint_every and \
+                        start + len(avg_rewards) < run.steps:
+                    run.end_block(components, start + len(avg_rewards))
+                    run.save(path)
+                    last_save = time.perf_counter()
+            run.aggregator.end_epoch()
+            run.end_epoch(components)
+            for observer in observers:
+                observer.on_epoch_end(run.epoch - 1, run.steps, time.perf_counter() - start_time, None)
+        if path is not None:
+            run.save(path)
+        for observer in observers:
+            observer.on_run_end(run.epochs, run.steps, time.perf_counter() - start_time)
+
+        return run.aggregator.get_result()
+
+    def _run_epoch(self, aggregator, steps, phase_times=None):
+        for start, avg_rewards, optimal_actions in self._run_blocks(steps, phase_times):
+            if phase_times is None:
+                aggregator.add_block(start, avg_rewards, optimal_actions)
+            else:
+                time_0 = time.perf_counter()
+                aggregator.add_block(start, avg_rewards, optimal_actions)
+                phase_times['aggregate'] += time.perf_counter() - time_0
+        aggregator.end_epoch()
+
+    def __getstate__(self):
+        # Observers stay in the parent process; they may hold files or loggers
+        state = self.__dict__.copy()
+        state['_observers'] = []
+        return state
+
+    def run_epochs_parallel(self, epochs=2000, steps=1000, workers=None, seed=None, chunk_size=None, **kwargs):
+        """
+        Runs simulation with number of epochs on a pool of worker processes. The epochs are split into chunks of
+        :chunk_size: epochs; every chunk has its own random stream spawned from :seed: and only sends back its
+        aggregator. Chunks are merged in a fixed order, so the results only depend on :seed: and :chunk_size:, never
+        on the number of :workers:. Takes the same aggregator arguments as **run_epochs**.
+        """
+        if chunk_size is None:
+            chunk_size = max(1, epochs // 64)
+        chunk_epochs = [min(chunk_size, epochs - start) for start in range(0, epochs, chunk_size)]
+        seed_sequences = np.random.SeedSequence(seed).spawn(len(chunk_epochs))
+
+        aggregator = make_aggregator(**kwargs)
+        aggregator.start(steps)
+        # Tasks are pickled while results are merged, so they get a copy that is never modified
+        pristine_aggregator = copy.deepcopy(aggregator)
+        for observer in self._observers:
+            observer.on_run_start(epochs, steps)
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(_run_epoch_chunk, [self] * len(chunk_epochs),
+                                  [pristine_aggregator] * len(chunk_epochs), seed_sequences, chunk_epochs,
+                                  [steps] * len(chunk_epochs))
+            finished_epochs = 0
+            for chunk_aggregator, epochs_in_chunk in zip(chunks, chunk_epochs):
+                aggregator.merge(chunk_aggregator)
+                # Workers do not measure phases; observers are told about every finished chunk
+                finished_epochs += epochs_in_chunk
+                for observer in self._observers:
+                    observer.on_epoch_end(finished_epochs - 1, steps, time.perf_counter() - start_time, None)
+        for observer in self._observers:
+            observer.on_run_end(epochs, steps, time.perf_counter() - start_time)
+
+        return aggregator.get_result()
+
+
+def _run_epoch_chunk(runner, aggregator, seed_sequence, epochs, steps):
+    """
+    Runs a chunk of epochs in a worker process with its own random stream.
+    :return: the aggregator of the chunk
+    """
+    seed_global_random(seed_sequence)
+
+    for epoch in range(0, epochs):
+        runner._run_epoch(aggregator, steps)
+
+    return aggregator
+
+
+def seed_global_random(seed_sequence):
+    """
+    Seeds the global random generators used by the framework classes from a numpy SeedSequence
+    """
+    np.random.seed(seed_sequence.generate_state(4))
+    random.seed(int(seed_sequence.generate_state(1)[0]))
+
+
+class BatchRunner:
+    """
+    Runs all epochs at once with the batched reward, estimator and selector classes. The state of every epoch lives
+    in (epochs, num_actions) arrays, so that each step is a few array operations over all epochs.
+    :param block_elements: size of the (epochs, steps) buffer handed to the aggregator
+    """
+
+    def __init__(self, action_reward, action_value_estimator, action_selector, block_elements=1 << 16):
+        self._action_reward = action_reward
+        self._action_value_estimator = action_value_estimator
+        self._action_selector = action_selector
+        self._block_elements = block_elements
+
+    def run_epochs(self, epochs=2000, steps=1000, **kwargs):
+        """
+        Runs simulation with number of epochs. Takes the same aggregator arguments and returns the same results as
+        **Runner.run_epochs**.
+        """
+        self._action_value_estimator.reset(epochs)
+        self._action_reward.reset(epochs)
+        aggregator = make_aggregator(**kwargs)
+        aggregator.start(steps)
+
+        has_optimal_action = self._action_reward.get_optimal_action() is not None
+        block_size = max(1, min(self._block_elements // epochs, steps))
+        avg_rewards = np.empty((epochs, block_size))
+        optimal_actions = np.empty((epochs, block_size), dtype=np.int8) if has_optimal_action else None
+
+        for start in range(0, steps, block_size):
+            block_steps = min(block_size, steps - start)
+            for step in range(0, block_steps):
+                actions = self._action_selector.select_action()
+                if has_optimal_action:
+                    optimal_actions[:, step] = actions == self._action_reward.get_optimal_action()
+                rewards = self._action_reward.get_reward(actions)
+                self._action_value_estimator.add_reward(actions, rewards)
+                avg_rewards[:, step] = self._action_value_estimator.get_avg_reward()
+
+            aggregator.add_block(start, avg_rewards[:, :block_steps],
+                                 None if optimal_actions is None else optimal_actions[:, :block_steps])
+
+        aggregator.end_epoch(epochs)
+        return aggregator.get_result()
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class BlockSampler:
+    """
+    Draws random numbers from the global numpy random generator in large blocks and hands them out one by one, so that
+    the cost of calling numpy is shared by the whole block. Pending numbers are not pickled: a copy sent to another
+    process starts with an empty block and only draws from the random stream of that process. To restore them, e.g.
+    from a checkpoint, the sampler keeps the state of the random generator its block was drawn from (see
+    **get_position**).
+    :param distribution: name of the numpy.random function, e.g. 'standard_normal' or 'randint'
+    :param args: arguments of the distribution
+    """
+
+    def __init__(self, distribution, *args, block_size=4096):
+        self._distribution = distribution
+        self._args = args
+        self._block_size = block_size
+        self._block = []
+        self._block_state = None
+        self._index = 0
+
+    def next(self):
+        """
+        :return: the next random number
+        """
+        if self._index == len(self._block):
+            self._block_state = np.random.get_state(legacy=False)
+            self._block = self._draw(self._block_size).tolist()
+            self._index = 0
+        value = self._block[self._index]
+        self._index += 1
+        return value
+
+    def take(self, n):
+        """
+        :return: array of the next n random numbers
+        """
+        pending = len(self._block) - self._index
+        if n <= pending:
+            values = np.array(self._block[self._index:self._index + n])
+            self._index += n
+            return values
+        values = np.empty(n, dtype=self._draw(0).dtype)
+        values[:pending] = self._block[self._index:]
+        values[pending:] = self._draw(n - pending)
+        self.clear()
+        return values
+
+    def clear(self):
+        """
+        Discards the pending random numbers
+        """
+        self._block = []
+        self._block_state = None
+        self._index = 0
+
+    def get_position(self):
+        """
+        :return: (state of the random generator the block was drawn from, numbers of the block handed out), or None if
+        no numbers are pending. Much smaller than the pending numbers themselves.
+        """
+        if self._index == len(self._block):
+            return None
+        return self._block_state, self._index
+
+    def set_position(self, position):
+        """
+        Draws the block of a **get_position** again and skips the numbers handed out, so that the pending numbers are
+        those of the sampler it came from. The global random generator is left as it was.
+        """
+        if position is None:
+            self.clear()
+            return
+        block_state, index = position
+        state = np.random.get_state(legacy=False)
+        np.random.set_state(block_state)
+        self._block = self._draw(self._block_size).tolist()
+        np.random.set_state(state)
+        self._block_state = block_state
+        self._index = index
+
+    def _draw(self, size):
+        return getattr(np.random, self._distribution)(*self._args, size=size)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_block'] = []
+        state['_block_state'] = None
+        state['_index'] = 0
+        return state
@@ -0,0 +1,141 @@
+"""Online bandit service on asyncio. Clients ask for actions and report rewards over a line based TCP protocol:
+
+    SELECT                   -> <action>
+    REWARD <action> <reward> -> OK
+
+Any other line gets ERROR <message>. Rewards are not applied one by one: reports are coalesced into micro-batches that
+go to **add_rewards** of the estimator once :max_batch: reports are pending or the oldest has waited :max_delay:
+seconds. The estimator only changes between batches, so every selection reads a consistent snapshot of the q-values,
+and the selections requested in the same turn of the event loop are served by one call to **select_actions**."""
+
+import asyncio
+import math
+import time
+
+import numpy as np
+
+
+class BanditService:
+    """
+    Serves an action selector and its action value estimator to concurrent clients of one event loop.
+    :param max_batch: pending rewards that trigger an update of the estimator
+    :param max_delay: seconds a reported reward may wait before the estimator is updated
+    :param max_selections: selections served by one call to **select_actions**
+    """
+
+    def __init__(self, action_value_estimator, action_selector, max_batch=256, max_delay=0.005, max_selections=1024):
+        self._action_value_estimator = action_value_estimator
+        self._action_selector = action_selector
+        self._num_actions = len(action_value_estimator.get_estimated_q_a())
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._max_selections = max_selections
+        self._actions = []
+        self._rewards = []
+        self._flush_handle = None
+        self._selections = []
+        self._stats = {'selections': 0, 'selection_batches': 0, 'rewards': 0, 'reward_batches': 0,
+                       'update_seconds': 0.0}
+
+    async def select(self):
+        """
+        :return: an action for the current estimates
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not self._selections:
+            asyncio.get_running_loop().call_soon(self._serve_selections)
+        self._selections.append(future)
+        return await future
+
+    def report(self, action, reward):
+        """
+        Queues the reward of an action; it is applied with the next micro-batch.
+        """
+        if not 0 <= action < self._num_actions:
+            raise ValueError("Unknown action: {}".format(action))
+        if not math.isfinite(reward):
+            raise ValueError("Reward is not finite: {}".format(reward))
+        self._actions.append(action)
+        self._rewards.append(reward)
+        if len(self._actions) >= self._max_batch:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self._max_delay, self.flush)
+
+    def flush(self):
+        """
+        Applies the pending rewards to the estimator. The pending rewards are taken first, so a batch that fails is
+        dropped instead of failing every later batch.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._actions:
+            return
+        actions, rewards = self._actions, self._rewards
+        self._actions = []
+        self._rewards = []
+        start = time.perf_counter()
+        self._action_value_estimator.add_rewards(np.array(actions), np.array(rewards))
+        self._stats['update_seconds'] += time.perf_counter() - start
+        self._stats['rewards'] += len(actions)
+        self._stats['reward_batches'] += 1
+
+    def get_stats(self):
+        """
+        :return: dict of the selections and rewards served, the batches they came in and the seconds spent updating
+        """
+        return dict(self._stats)
+
+    def _serve_selections(self):
+        selections = self._selections[:self._max_selections]
+        self._selections = self._selections[self._max_selections:]
+        if self._selections:
+            asyncio.get_running_loop().call_soon(self._serve_selections)
+        try:
+            actions = self._action_selector.select_actions(len(selections)).tolist()
+        except Exception as e:
+            # The waiting clients get the error instead of waiting forever
+            for future in selections:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, action in zip(selections, actions):
+            if not future.done():
+                future.set_result(action)
+        self._stats['selections'] += len(selections)
+        self._stats['selection_batches'] += 1
+
+    async def start_server(self, host='127.0.0.1', port=0):
+        """
+        :param port: 0 picks a free port, see the sockets of the returned server
+        :return: the asyncio.Server accepting clients
+        """
+        return await asyncio.start_server(self._handle_client, host, port)
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(await self._handle_line(line))
+                if writer.transport.get_write_buffer_size() > 65536:
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_line(self, line):
+        fields = line.split()
+        try:
+            if fields == [b'SELECT']:
+                return b'%d\n' % await self.select()
+            if len(fields) == 3 and fields[0] == b'REWARD':
+                self.report(int(fields[1]), float(fields[2]))
+                return b'OK\n'
+            raise ValueError("Unknown request: {!r}".format(line.strip()))
+        except Exception as e:
+            # Bad requests, and failures of the selector or estimator, are reported to the client
+            return 'ERROR {}\n'.format(e).encode()
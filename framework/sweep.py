@@ -0,0 +1,175 @@
+"""Parameter sweeps over bandit experiments. Every cell of the grid builds its own reward, estimator and selector,
+runs on a process pool and is stored in an on-disk cache keyed by the hash of its config, so that an interrupted or
+extended sweep only computes the missing cells."""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from framework.runner import Runner, seed_global_random
+
+logger = logging.getLogger(__name__)
+
+
+class SweepCell:
+    """
+    One cell of a parameter sweep. The components are given as (class, kwargs) pairs so that every cell builds fresh
+    objects and its config can be hashed. The action selector is built with the estimator as first argument.
+    :param run_kwargs: aggregator arguments of **Runner.run_epochs**, e.g. aggregator and trailing_steps
+    """
+
+    def __init__(self, action_reward, action_value_estimator, action_selector, epochs, steps, seed=0, **run_kwargs):
+        self.action_reward = action_reward
+        self.action_value_estimator = action_value_estimator
+        self.action_selector = action_selector
+        self.epochs = epochs
+        self.steps = steps
+        self.seed = seed
+        self.run_kwargs = run_kwargs
+
+    def get_config(self):
+        """
+        :return: JSON serializable description of the cell
+        """
+        return {
+            'action_reward': _component_config(self.action_reward),
+            'action_value_estimator': _component_config(self.action_value_estimator),
+            'action_selector': _component_config(self.action_selector),
+            'epochs': self.epochs,
+            'steps': self.steps,
+            'seed': self.seed,
+            'run_kwargs': self.run_kwargs,
+            # Every epoch draws from its own random stream, see **Runner.run_checkpointed**
+            'random_streams': 'per_epoch'
+        }
+
+    def get_key(self):
+        """
+        :return: hash of the config, used as the cache key
+        """
+        config = json.dumps(self.get_config(), sort_keys=True)
+        return hashlib.sha1(config.encode('utf-8')).hexdigest()
+
+    def run(self, checkpoint=None, checkpoint_every=60.0):
+        """
+        Builds the runner and runs the epochs with **Runner.run_checkpointed**, whose epochs draw from random streams
+        spawned from the key of the cell, so the result is the same with or without a checkpoint. With a :checkpoint:
+        path, the progress is saved there, and a cell whose checkpoint exists resumes from it.
+        :return: the result of **Runner.run_epochs**
+        """
+        seed = int(self.get_key(), 16)
+        seed_global_random(np.random.SeedSequence(seed))
+
+        reward_class, reward_kwargs = self.action_reward
+        estimator_class, estimator_kwargs = self.action_value_estimator
+        selector_class, selector_kwargs = self.action_selector
+        action_reward = reward_class(**reward_kwargs)
+        action_value_estimator = estimator_class(**estimator_kwargs)
+        action_selector = selector_class(action_value_estimator, **selector_kwargs)
+        runner = Runner(action_reward, action_value_estimator, action_selector)
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            return runner.resume(checkpoint, checkpoint_every)
+        return runner.run_checkpointed(checkpoint, self.epochs, self.steps, seed, checkpoint_every, **self.run_kwargs)
+
+    @staticmethod
+    def grid(action_rewards, action_value_estimators, action_selectors, epochs, steps, seed=0, **run_kwargs):
+        """
+        :return: one cell for every combination of the given (class, kwargs) components
+        """
+        return [SweepCell(action_reward, action_value_estimator, action_selector, epochs, steps, seed, **run_kwargs)
+                for action_reward, action_value_estimator, action_selector in
+                itertools.product(action_rewards, action_value_estimators, action_selectors)]
+
+
+def expand(component_class, **param_values):
+    """
+    Example: expand(GreedyActionSelector, epsilon=[0.1, 0.2]) ->
+    [(GreedyActionSelector, {'epsilon': 0.1}), (GreedyActionSelector, {'epsilon': 0.2})]
+    :return: a (class, kwargs) pair for every combination of the parameter values
+    """
+    names = sorted(param_values)
+    return [(component_class, dict(zip(names, values)))
+            for values in itertools.product(*[param_values[name] for name in names])]
+
+
+class ParameterSweep:
+    """
+    Runs sweep cells concurrently and caches every finished cell in :cache_dir:.
+    :param workers: number of worker processes, defaults to the number of cores
+    :param checkpoint_every: if given, the cells also save their progress to :cache_dir: every :checkpoint_every:
+    seconds, so that the cells an interrupted sweep was running resume where they stopped
+    """
+
+    def __init__(self, cache_dir, workers=None, checkpoint_every=None):
+        self._cache_dir = cache_dir
+        self._workers = workers
+        self._checkpoint_every = checkpoint_every
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def run(self, cells):
+        """
+        Runs the cells that are not cached yet.
+        :return: the result of each cell, in the order of the cells
+        """
+        results = {}
+        missing = {}
+        for cell in cells:
+            key = cell.get_key()
+            if key in results or key in missing:
+                continue
+            cached = self._load(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                missing[key] = cell
+
+        if missing:
+            logger.info("Running %d of %d sweep cells", len(missing), len(cells))
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                futures = {executor.submit(_run_cell, cell, self._checkpoint_path(key), self._checkpoint_every): key
+                           for key, cell in missing.items()}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    results[key] = future.result()
+                    self._store(key, missing[key], results[key])
+                    if self._checkpoint_every is not None:
+                        os.remove(self._checkpoint_path(key))
+
+        return [results[cell.get_key()] for cell in cells]
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, key + '.pkl')
+
+    def _checkpoint_path(self, key):
+        return None if self._checkpoint_every is None else os.path.join(self._cache_dir, key + '.ckpt')
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)['result']
+
+    def _store(self, key, cell, result):
+        # Write to a temporary file first, so that an interrupted sweep never leaves a partial cell behind
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'config': cell.get_config(), 'result': result}, f)
+        os.replace(tmp_path, path)
+
+
+def _component_config(component):
+    component_class, kwargs = component
+    return {'class': component_class.__module__ + '.' + component_class.__qualname__, 'kwargs': kwargs}
+
+
+def _run_cell(cell, checkpoint, checkpoint_every):
+    return cell.run(checkpoint, checkpoint_every)
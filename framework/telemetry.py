@@ -0,0 +1,142 @@
+"""Observers that receive telemetry from a **Runner**: per phase timings, epoch and step counters and throughput. The
+runner only measures phase timings when one of its observers asks for them, and does no extra work per step when it has
+no observers."""
+
+import json
+import logging
+import sys
+import time
+from datetime import timedelta
+
+PHASES = ('select', 'reward', 'update', 'aggregate')
+
+
+class RunnerObserver:
+    """
+    Receives telemetry from a **Runner**. All callbacks do nothing by default.
+    :measures_phases: if True, the runner times the phases of every step and passes them to **on_epoch_end**
+    """
+
+    measures_phases = False
+
+    def on_run_start(self, epochs, steps):
+        pass
+
+    def on_epoch_end(self, epoch, steps, elapsed, phase_times):
+        """
+        :param epoch: index of the finished epoch
+        :param steps: number of steps per epoch
+        :param elapsed: seconds since the start of the run
+        :param phase_times: seconds spent in each phase during the epoch, or None if no observer measures phases
+        """
+        pass
+
+    def on_run_end(self, epochs, steps, elapsed):
+        pass
+
+
+class PhaseProfiler(RunnerObserver):
+    """
+    Adds up the time spent selecting actions, sampling rewards, updating the estimator and aggregating the metrics.
+    """
+
+    measures_phases = True
+
+    def __init__(self):
+        self._phase_times = dict.fromkeys(PHASES, 0.0)
+        self._steps = 0
+        self._elapsed = 0.0
+
+    def on_run_start(self, epochs, steps):
+        self._phase_times = dict.fromkeys(PHASES, 0.0)
+        self._steps = 0
+
+    def on_epoch_end(self, epoch, steps, elapsed, phase_times):
+        if phase_times is None:
+            # Parallel runs report finished chunks without phase timings
+            self._steps = (epoch + 1) * steps
+            self._elapsed = elapsed
+            return
+        for phase, seconds in phase_times.items():
+            self._phase_times[phase] += seconds
+        self._steps += steps
+        self._elapsed = elapsed
+
+    def get_report(self):
+        """
+        :return: seconds and share of the total time for each phase, and the steps per second
+        """
+        total = sum(self._phase_times.values())
+        return {
+            'phases': {phase: {'seconds': seconds, 'share': seconds / total if total else 0.0}
+                       for phase, seconds in self._phase_times.items()},
+            'steps': self._steps,
+            'steps_per_sec': self._steps / self._elapsed if self._elapsed else 0.0
+        }
+
+
+class ProgressReporter(RunnerObserver):
+    """
+    Reports progress, throughput and estimated time left every :every: epochs, to a logger if one is given, otherwise
+    to :stream: (stdout by default).
+    """
+
+    def __init__(self, every=200, stream=None, logger=None):
+        self._every = every
+        self._stream = stream
+        self._logger = logger
+        self._epochs = 0
+
+    def on_run_start(self, epochs, steps):
+        self._epochs = epochs
+
+    def on_epoch_end(self, epoch, steps, elapsed, phase_times):
+        done = epoch + 1
+        if done % self._every != 0 or done >= self._epochs:
+            return
+        eta = elapsed / done * (self._epochs - done)
+        message = "Epoch {}/{} ({:.0%}), {:,.0f} steps/s, ETA {}".format(
+            done, self._epochs, done / self._epochs, done * steps / elapsed, timedelta(seconds=round(eta)))
+        if self._logger is not None:
+            self._logger.info(message)
+        else:
+            print(message, file=self._stream or sys.stdout)
+
+
+class MetricsFileObserver(RunnerObserver):
+    """
+    Appends one JSON line per :every: epochs to :path:, with the counters, throughput and phase timings.
+    """
+
+    def __init__(self, path, every=1):
+        self._path = path
+        self._every = every
+        self._file = None
+
+    def on_run_start(self, epochs, steps):
+        self._file = open(self._path, 'a')
+
+    def on_epoch_end(self, epoch, steps, elapsed, phase_times):
+        if (epoch + 1) % self._every != 0:
+            return
+        record = {
+            'time': time.time(),
+            'epoch': epoch,
+            'steps': (epoch + 1) * steps,
+            'elapsed': elapsed,
+            'steps_per_sec': (epoch + 1) * steps / elapsed if elapsed else 0.0,
+            'phases': phase_times
+        }
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def on_run_end(self, epochs, steps, elapsed):
+        self._file.close()
+        self._file = None
+
+
+def logging_progress_reporter(every=200, name='framework.runner'):
+    """
+    :return: a **ProgressReporter** that reports to the logger with the given name
+    """
+    return ProgressReporter(every, logger=logging.getLogger(name))
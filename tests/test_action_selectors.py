@@ -0,0 +1,24 @@
+import numpy as np
+
+from framework.action_selectors import BatchGreedyActionSelector
+from framework.action_value_estimators import BatchIncrementalRewardActionValueEstimator
+
+
+def test_batch_greedy_breaks_ties_uniformly():
+    np.random.seed(0)
+    estimator = BatchIncrementalRewardActionValueEstimator(4)
+    estimator.reset(40000)
+    selector = BatchGreedyActionSelector(estimator, 0)
+
+    counts = np.bincount(selector.select_action(), minlength=4)
+    np.testing.assert_allclose(counts / 40000, 0.25, atol=0.01)
+
+
+def test_batch_greedy_picks_the_unique_maximum():
+    np.random.seed(0)
+    estimator = BatchIncrementalRewardActionValueEstimator(4)
+    estimator.reset(1000)
+    estimator.add_reward(np.full(1000, 2), np.ones(1000))
+    selector = BatchGreedyActionSelector(estimator, 0)
+
+    np.testing.assert_array_equal(selector.select_action(), 2)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from framework.action_value_estimators import AverageRewardsEstimator, CompactConstantStepSizeActionValueEstimator, \
+    CompactIncrementalRewardActionValueEstimator, ConstantStepSizeActionValueEstimator, \
+    IncrementalRewardActionValueEstimator
+
+ESTIMATORS = {
+    'avg': lambda: AverageRewardsEstimator(20),
+    'incremental': lambda: IncrementalRewardActionValueEstimator(20),
+    'constant_step_size': lambda: ConstantStepSizeActionValueEstimator(20, 0.1),
+    'compact_incremental': lambda: CompactIncrementalRewardActionValueEstimator(20, np.float64),
+    'compact_constant_step_size': lambda: CompactConstantStepSizeActionValueEstimator(20, 0.1, np.float64)
+}
+
+
+@pytest.mark.parametrize('name', ESTIMATORS)
+def test_add_rewards_matches_add_reward(name):
+    random = np.random.default_rng(0)
+    one_by_one, batched = ESTIMATORS[name](), ESTIMATORS[name]()
+    for _ in range(50):
+        # Few actions, so that most batches update the same action several times
+        actions = random.integers(0, 20, 100)
+        rewards = random.normal(size=100)
+        for action, reward in zip(actions.tolist(), rewards.tolist()):
+            one_by_one.add_reward(action, reward)
+        batched.add_rewards(actions, rewards)
+
+        np.testing.assert_allclose(batched.get_estimated_q_a(), one_by_one.get_estimated_q_a(), rtol=1e-9,
+                                   atol=1e-12)
+        np.testing.assert_array_equal(batched.get_action_counts(), one_by_one.get_action_counts())
+        assert batched.get_avg_reward() == pytest.approx(one_by_one.get_avg_reward())
+        assert sorted(batched.get_greedy_actions()) == sorted(one_by_one.get_greedy_actions())
+
+
+@pytest.mark.parametrize('name', ESTIMATORS)
+def test_add_rewards_accepts_empty_batch(name):
+    estimator = ESTIMATORS[name]()
+    estimator.add_rewards(np.array([], dtype=int), np.array([]))
+    estimator.add_rewards([1, 2], [1.0, 0.5])
+    estimator.add_rewards(np.array([], dtype=int), np.array([]))
+    assert estimator.get_steps() == 2
+    assert estimator.get_greedy_actions() == [1]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from framework.aggregators import StepStatsAggregator
+
+
+def aggregate(avg_rewards, block_size, every=1):
+    """
+    Adds the (epochs, steps) rewards epoch by epoch, in blocks of :block_size: steps.
+    """
+    aggregator = StepStatsAggregator(every)
+    aggregator.start(avg_rewards.shape[1])
+    for epoch_rewards in avg_rewards:
+        for start in range(0, len(epoch_rewards), block_size):
+            aggregator.add_block(start, epoch_rewards[start:start + block_size])
+        aggregator.end_epoch()
+    return aggregator
+
+
+@pytest.mark.parametrize('every', [1, 3])
+def test_welford_matches_mean_and_std(every):
+    avg_rewards = np.random.default_rng(0).normal(1.0, 2.0, (40, 100))
+    result = aggregate(avg_rewards, block_size=17, every=every).get_result()
+
+    np.testing.assert_array_equal(result.steps, np.arange(0, 100, every))
+    np.testing.assert_allclose(result.mean, avg_rewards[:, ::every].mean(axis=0))
+    np.testing.assert_allclose(result.std, avg_rewards[:, ::every].std(axis=0, ddof=1))
+
+
+def test_chan_block_of_epochs_and_merge_match_single_pass():
+    avg_rewards = np.random.default_rng(1).normal(size=(30, 50))
+    expected = aggregate(avg_rewards, block_size=50).get_result()
+
+    # All epochs of a block at once, as the batch runner adds them
+    batched = StepStatsAggregator()
+    batched.start(50)
+    batched.add_block(0, avg_rewards[:, :20])
+    batched.add_block(20, avg_rewards[:, 20:])
+    batched.end_epoch(30)
+
+    # Disjoint epochs aggregated apart and merged, as the parallel runner does
+    merged = aggregate(avg_rewards[:11], block_size=8).merge(aggregate(avg_rewards[11:], block_size=13))
+
+    for aggregator in (batched, merged):
+        result = aggregator.get_result()
+        np.testing.assert_allclose(result.mean, expected.mean)
+        np.testing.assert_allclose(result.std, expected.std)
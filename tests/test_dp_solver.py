@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from chap_4.dp_solver import DPSolver, TabularModel
+from chap_4.jacks_car_rental.fleet_model import FleetRentalModel
+from chap_4.jacks_car_rental.rental_model import RentalModel
+from chap_4.jacks_car_rental.rental_policy import StatesActions
+
+GAMMA = 0.9
+# Action of the model below that moves no cars, valid in every state
+NO_MOVE = 2
+
+
+@pytest.fixture(scope='module')
+def model():
+    return FleetRentalModel(max_cars=5, max_move=2)
+
+
+@pytest.fixture(scope='module')
+def optimal_values(model):
+    return DPSolver(model, GAMMA, threshold=1e-12).value_iteration(np.zeros(model.num_states)).values
+
+
+def policy_values(model, policy):
+    """
+    :return: exact values of the policy, so that policies that differ only in tied actions compare equal
+    """
+    values = np.zeros(model.num_states)
+    DPSolver(model, GAMMA, evaluation='direct').evaluate_policy(values, policy, None)
+    return values
+
+
+@pytest.mark.parametrize('solve', [
+    lambda model: DPSolver(model, GAMMA, 1e-10, sweep='gauss_seidel').value_iteration(np.zeros(model.num_states)),
+    lambda model: DPSolver(model, GAMMA, 1e-10).prioritized_value_iteration(np.zeros(model.num_states)),
+    lambda model: DPSolver(model, GAMMA, 1e-10).prioritized_value_iteration(np.zeros(model.num_states), batch_size=1),
+    lambda model: DPSolver(model, GAMMA, 1e-10).policy_iteration(np.zeros(model.num_states),
+                                                                 np.full(model.num_states, NO_MOVE)),
+    lambda model: DPSolver(model, GAMMA, 1e-10).modified_policy_iteration(np.zeros(model.num_states),
+                                                                          np.full(model.num_states, NO_MOVE)),
+    lambda model: DPSolver(model, GAMMA, 1e-10, evaluation='direct').policy_iteration(
+        np.zeros(model.num_states), np.full(model.num_states, NO_MOVE)),
+    lambda model: DPSolver(model, GAMMA, 1e-10, evaluation='iterative').policy_iteration(
+        np.zeros(model.num_states), np.full(model.num_states, NO_MOVE))
+], ids=['gauss_seidel', 'prioritized', 'prioritized_single', 'policy_iteration', 'modified_policy_iteration', 'direct',
+        'iterative'])
+def test_solver_modes_agree(model, optimal_values, solve):
+    result = solve(model)
+    np.testing.assert_allclose(result.values, optimal_values, atol=1e-6)
+    np.testing.assert_allclose(policy_values(model, result.policy), optimal_values, atol=1e-6)
+
+
+def test_default_predecessors_match_rental_model():
+    model = RentalModel(StatesActions(max_cars=6, max_move=2).get_state_actions())
+    for (states, probabilities), (default_states, default_probabilities) in zip(
+            model.predecessors(), TabularModel.predecessors(model)):
+        order, default_order = np.argsort(states), np.argsort(default_states)
+        np.testing.assert_array_equal(np.asarray(states)[order], default_states[default_order])
+        np.testing.assert_allclose(np.asarray(probabilities)[order], default_probabilities[default_order])
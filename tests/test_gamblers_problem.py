@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from chap_4.dp_checkpoint import save_checkpoint
+from chap_4.dp_solver import DPSolver
+from chap_4.gamblers_problem import BatchGamblerSolver, GamblerPolicy, PolicyIteration
+
+
+def test_batch_solver_matches_single_solver():
+    p_heads = [0.25, 0.4, 0.55]
+    result = BatchGamblerSolver(p_heads, goal=30, threshold=1e-12).solve()
+
+    assert result.converged.all()
+    for index, p_head in enumerate(p_heads):
+        model = GamblerPolicy(p_head, goal=30)
+        single = DPSolver(model, gamma=1.0, threshold=1e-12).value_iteration(np.zeros(model.num_states))
+        np.testing.assert_allclose(result.values[index], single.values, atol=1e-9)
+        # Every action of the batch policy is greedy for the single solver's values
+        q_values = model.q_values(single.values, 1.0, np.arange(1, 30))
+        chosen = q_values[np.arange(29), result.policy[index, 1:-1]]
+        np.testing.assert_allclose(chosen, q_values.max(axis=1), atol=1e-9)
+
+
+def test_policy_iteration_sweeps_agree():
+    state_values = []
+    for sweep in ('jacobi', 'gauss_seidel'):
+        policy_iteration = PolicyIteration(GamblerPolicy(0.4, goal=30), gamma=1.0, sweep=sweep)
+        policy_iteration.improve_policy()
+        state_values.append(list(policy_iteration.state_value.values()))
+    np.testing.assert_allclose(state_values[0], state_values[1], atol=1e-9)
+
+
+def test_warm_start_rejects_other_goal(tmp_path):
+    checkpoint = str(tmp_path / 'goal_20.npz')
+    save_checkpoint(checkpoint, np.zeros(21))
+    with pytest.raises(ValueError):
+        PolicyIteration(GamblerPolicy(0.4, goal=30)).warm_start(checkpoint)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from framework.max_tree import MaxTree
+
+
+def check_tree(tree, values):
+    greedy_actions = np.flatnonzero(values == values.max())
+    assert tree.max() == values.max()
+    assert tree.count_max() == len(greedy_actions)
+    # Evenly spaced uniforms pick every greedy action once, in order
+    picked = [tree.argmax((rank + 0.5) / len(greedy_actions)) for rank in range(len(greedy_actions))]
+    assert picked == greedy_actions.tolist()
+
+
+@pytest.mark.parametrize('size', [1, 7, 64, 100])
+def test_setitem_keeps_max_count_and_argmax(size):
+    random = np.random.default_rng(size)
+    tree = MaxTree(size, np.float64)
+    values = np.zeros(size)
+    check_tree(tree, values)
+    for _ in range(500):
+        # Few distinct values, so that the maximum is often tied
+        index, value = int(random.integers(size)), float(random.integers(-3, 3))
+        tree[index] = value
+        values[index] = value
+        check_tree(tree, values)
+        assert tree[index] == value
+
+
+def test_rebuild_after_writing_the_values():
+    tree = MaxTree(50, np.float32)
+    values = np.random.default_rng(0).integers(0, 5, 50).astype(np.float32)
+    tree.get_values()[:] = values
+    tree.rebuild()
+    check_tree(tree, values)
+    np.testing.assert_array_equal(tree.get_values(), values)
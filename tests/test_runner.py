@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from framework.action_selectors import GreedyActionSelector
+from framework.action_value_estimators import IncrementalRewardActionValueEstimator
+from framework.checkpoint import RunCheckpoint
+from framework.rewards import NormalDistributionReward
+from framework.runner import Runner
+
+
+def make_runner():
+    estimator = IncrementalRewardActionValueEstimator(10)
+    # Small blocks, so that a run saves several times per epoch
+    return Runner(NormalDistributionReward(10), estimator, GreedyActionSelector(estimator, 0.1), block_size=64)
+
+
+def assert_same_result(result, expected):
+    assert len(result) == len(expected)
+    for values, expected_values in zip(result, expected):
+        np.testing.assert_array_equal(values, expected_values)
+
+
+def test_parallel_results_do_not_depend_on_workers():
+    results = [make_runner().run_epochs_parallel(8, 200, workers=workers, seed=3, chunk_size=2)
+               for workers in (1, 2)]
+    assert_same_result(results[1], results[0])
+
+
+def test_resume_after_crash_matches_uninterrupted_run(tmp_path, monkeypatch):
+    expected = make_runner().run_checkpointed(None, 4, 300, seed=5)
+
+    class Crash(Exception):
+        pass
+
+    save = RunCheckpoint.save
+    saves = []
+
+    def crashing_save(run, path):
+        save(run, path)
+        saves.append(run.epoch)
+        if len(saves) == 7:
+            raise Crash()
+
+    monkeypatch.setattr(RunCheckpoint, 'save', crashing_save)
+    checkpoint = str(tmp_path / 'run.ckpt')
+    with pytest.raises(Crash):
+        make_runner().run_checkpointed(checkpoint, 4, 300, seed=5, checkpoint_every=0.0)
+    monkeypatch.setattr(RunCheckpoint, 'save', save)
+
+    assert_same_result(make_runner().resume(checkpoint), expected)
+
+
+def test_extend_matches_longer_run(tmp_path):
+    expected = make_runner().run_checkpointed(None, 3, 500, seed=7)
+    checkpoint = str(tmp_path / 'run.ckpt')
+    make_runner().run_checkpointed(checkpoint, 3, 300, seed=7, extendable=True)
+
+    assert_same_result(make_runner().extend(checkpoint, 500), expected)
+
+
+def test_extend_needs_an_extendable_run(tmp_path):
+    checkpoint = str(tmp_path / 'run.ckpt')
+    make_runner().run_checkpointed(checkpoint, 2, 100, seed=7)
+    with pytest.raises(ValueError):
+        make_runner().extend(checkpoint, 200)